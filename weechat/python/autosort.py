@@ -78,6 +78,7 @@
 #
 
 
+import bisect
 import json
 import math
 import re
@@ -97,6 +98,8 @@ hooks              = []
 signal_delay_timer = None
 sort_limit_timer   = None
 sort_queued        = False
+sort_key_cache     = {}
+dirty_buffers      = set()
 
 
 # Make sure that unicode, bytes and str are always available in python2 and 3.
@@ -339,6 +342,7 @@ class Config:
 
 		self.rules          = decode_rules(rules_blob)
 		self.helpers        = decode_helpers(helpers_blob)
+		self.cache_keys     = only_buffer_expressions(self.rules + list(self.helpers.values()))
 		self.signals        = signals_blob.split()
 		self.signal_delay   = weechat.config_integer(self.__signal_delay)
 		self.sort_limit     = weechat.config_integer(self.__sort_limit)
@@ -395,12 +399,73 @@ def merge_buffer_list(buffers):
 		result[number].append(buffer)
 	return result.values()
 
-def sort_buffers(hdata, buffers, rules, helpers, case_sensitive):
+# Parts of eval expressions which depend on more than the buffer being evaluated.
+# Sort keys of rules using them can change without a signal for the buffer, so they are not cached.
+# The info hooks of autosort itself only transform their arguments.
+non_buffer_expression = re.compile(r'\$\{(?:info:(?!autosort_)|window|hdata|date|env:|sec\.data|random:)|hotlist|next_buffer|prev_buffer')
+
+def only_buffer_expressions(expressions):
+	''' Check if the given eval expressions only depend on the buffer they are evaluated for. '''
+	return not any(non_buffer_expression.search(expression) for expression in expressions)
+
+def is_buffer_pointer(pointer):
+	''' Check if a pointer from the data of a signal points to an existing buffer. '''
+	hdata = weechat.hdata_get('buffer')
+	return bool(weechat.hdata_check_pointer(hdata, weechat.hdata_get_list(hdata, 'gui_buffers'), pointer))
+
+def invalidate_sort_keys():
+	''' Forget all cached sort keys, so the next sort evaluates every buffer. '''
+	sort_key_cache.clear()
+	dirty_buffers.clear()
+
+def mark_buffer_dirty(signal_data):
+	'''
+	Mark the buffer from the data of a signal as needing a new sort key.
+	Signals which don't carry a buffer pointer, like window_switch, invalidate all sort keys.
+	'''
+	if isinstance(signal_data, str) and signal_data.startswith('0x') and is_buffer_pointer(signal_data):
+		dirty_buffers.add(signal_data)
+	else:
+		invalidate_sort_keys()
+
+def sort_buffers_incremental(buffers, rules, helpers, case_sensitive):
+	'''
+	Sort a list of MergedBuffers, only evaluating the rules for buffers without a cached sort key.
+
+	Groups with only cached keys keep their relative order, so they are sorted without evaluating anything.
+	The other groups are then placed by binary insertion.
+	Ties are broken on the current buffer number, which gives the same order as a full stable sort.
+	'''
+	buffer_key = buffer_sort_key(rules, helpers, case_sensitive)
+	present    = set()
+	clean      = []
+	dirty      = []
+
 	for merged in buffers:
+		present.update(merged)
+		is_dirty = False
+		best     = None
 		for buffer in merged:
-			name = weechat.hdata_string(hdata, buffer, 'name')
-
-	return sorted(buffers, key=merged_sort_key(rules, helpers, case_sensitive))
+			if buffer in dirty_buffers or buffer not in sort_key_cache:
+				sort_key_cache[buffer] = buffer_key(buffer)
+				is_dirty = True
+			this = sort_key_cache[buffer]
+			if best is None or this < best: best = this
+		(dirty if is_dirty else clean).append(((best, merged.number), merged))
+
+	# Forget closed buffers, their pointers may be reused.
+	for buffer in list(sort_key_cache):
+		if buffer not in present: del sort_key_cache[buffer]
+	dirty_buffers.clear()
+
+	clean.sort(key=lambda entry: entry[0])
+	keys   = [key for key, merged in clean]
+	result = [merged for key, merged in clean]
+	for key, merged in dirty:
+		index = bisect.bisect_right(keys, key)
+		keys.insert(index, key)
+		result.insert(index, merged)
+	return result
 
 def buffer_sort_key(rules, helpers, case_sensitive):
 	''' Create a sort key function for a list of lists of merged buffers. '''
@@ -417,20 +482,12 @@ def buffer_sort_key(rules, helpers, case_sensitive):
 
 	return key
 
-def merged_sort_key(rules, helpers, case_sensitive):
-	buffer_key = buffer_sort_key(rules, helpers, case_sensitive)
-	def key(merged):
-		best = None
-		for buffer in merged:
-			this = buffer_key(buffer)
-			if best is None or this < best: best = this
-		return best
-	return key
-
 def apply_buffer_order(buffers):
 	''' Sort the buffers in weechat according to the given order. '''
 	for i, buffer in enumerate(buffers):
-		weechat.buffer_set(buffer[0], "number", str(i + 1))
+		# Moving a buffer shifts the numbers of others, so check the current number.
+		if weechat.buffer_get_integer(buffer[0], "number") != i + 1:
+			weechat.buffer_set(buffer[0], "number", str(i + 1))
 
 def split_args(args, expected, optional = 0):
 	''' Split an argument string in the desired number of arguments. '''
@@ -442,9 +499,13 @@ def split_args(args, expected, optional = 0):
 def do_sort(verbose = False):
 	start = perf_counter()
 
+	# Sort keys of rules which depend on more than the buffer itself may have changed without a signal.
+	if not config.cache_keys:
+		invalidate_sort_keys()
+
 	hdata, buffers = get_buffers()
 	buffers = merge_buffer_list(buffers)
-	buffers = sort_buffers(hdata, buffers, config.rules, config.helpers, config.case_sensitive)
+	buffers = sort_buffers_incremental(buffers, config.rules, config.helpers, config.case_sensitive)
 	apply_buffer_order(buffers)
 
 	elapsed = perf_counter() - start
@@ -455,6 +516,7 @@ def do_sort(verbose = False):
 
 def command_sort(buffer, command, args):
 	''' Sort the buffers and print a confirmation. '''
+	invalidate_sort_keys()
 	do_sort(True)
 	return weechat.WEECHAT_RC_OK
 
@@ -643,6 +705,8 @@ def on_signal(data, signal, signal_data):
 	global signal_delay_timer
 	global sort_queued
 
+	mark_buffer_dirty(signal_data)
+
 	# If the sort limit timeout is started, we're in the hold-off time after sorting, just queue a sort.
 	if sort_limit_timer is not None:
 		if sort_queued:
@@ -659,7 +723,7 @@ def on_signal(data, signal, signal_data):
 
 	# Otherwise, start the signal delay timeout.
 	debug('Signal {0} received, starting signal delay timeout of {1} ms.'.format(signal, config.signal_delay))
-	weechat.hook_timer(config.signal_delay, 0, 1, "on_signal_delay_timeout", "")
+	signal_delay_timer = weechat.hook_timer(config.signal_delay, 0, 1, "on_signal_delay_timeout", "")
 	return weechat.WEECHAT_RC_OK
 
 def on_signal_delay_timeout(pointer, remaining_calls):
@@ -725,6 +789,7 @@ def apply_config():
 def on_config_changed(*args, **kwargs):
 	''' Called whenever the configuration changes. '''
 	config.reload()
+	invalidate_sort_keys()
 	apply_config()
 
 	return weechat.WEECHAT_RC_OK
@@ -999,6 +1064,14 @@ If you remove all signals you can still sort your buffers manually with the
 `{*default}/autosort sort{reset}` command. To prevent all automatic sorting, the option
 `{cyan}autosort.sorting.sort_on_config_change{reset}` should also be disabled.
 
+The sort keys of buffers are cached, and only evaluated again for the buffer a
+signal is about. Signals which are not about a buffer cause all sort keys to be
+evaluated again. So do rules and helpers which use info hooks other than those
+of autosort, the hotlist, windows, hdata, dates, environment variables or
+secured data, since they can change without a signal for the buffer. Other
+buffer properties which change without a signal, like local variables, are only
+picked up on the next signal for the buffer or with `{*default}/autosort sort{reset}`.
+
 {*white}# Recommended settings
 For the best visual effect, consider setting the following options:
   {*white}/set {cyan}irc.look.server_buffer{reset} {brown}independent{reset}
@@ -29,11 +29,10 @@
 
 from __future__ import print_function
 
-import os
 import re
-import subprocess
 import sys
 import time
+from collections import OrderedDict
 
 
 # Ensure that we are running under WeeChat.
@@ -64,6 +63,9 @@ SCRIPT_SHUTDOWN_FUNC = ''
 # Used character set (utf-8 by default).
 SCRIPT_CHARSET = ''
 
+# Time after which a running notify-send is killed (in milliseconds).
+NOTIFY_SEND_TIMEOUT = 30000
+
 # Script options.
 OPTIONS = {
     'notify_on_highlights': (
@@ -108,7 +110,22 @@ OPTIONS = {
     'min_notification_delay': (
         '500',
         'A minimal delay between successive notifications from the same '
-        'buffer (in milliseconds; set to 0 to show all notifications).'
+        'buffer; notifications that arrive sooner are sent as a single '
+        'summary notification once the delay has passed (in milliseconds; '
+        '0 means no delay).'
+    ),
+    'batch_delay': (
+        '250',
+        'Time to wait for more notifications from the same buffer before '
+        'sending them; several notifications from a buffer are sent as a '
+        'single summary notification (in milliseconds; set both this and '
+        'min_notification_delay to 0 to send every notification separately).'
+    ),
+    'max_queued_notifications': (
+        '10',
+        'Maximal number of buffers with notifications waiting to be sent; '
+        'when exceeded, the oldest waiting notifications are dropped (0 means '
+        'no limit).'
     ),
     'ignore_messages_tagged_with': (
         ','.join([
@@ -203,6 +220,26 @@ class Notification(object):
         self.urgency = urgency
 
 
+# Notifications waiting to be sent, in the order in which the buffers were
+# queued. Maps a buffer to a triple (number of notifications, last
+# notification, time when they should be sent).
+queued_notifications = OrderedDict()
+
+# The timer hook that sends the queued notifications (None when not running)
+# and the time when it fires.
+send_queued_notifications_timer = None
+send_queued_notifications_time = None
+
+# The name of the buffer-local variable holding the time of the last
+# notification sent from the buffer. A buffer-local variable makes it
+# persistent over the lifetime of this script.
+LAST_NOTIFICATION_TIME_VAR = 'notify_send_last_notification_time'
+
+# Parsed values of options, so that they are not read and parsed again for
+# every printed message. Cleared whenever an option of this script changes.
+parsed_option_values = {}
+
+
 def default_value_of(option):
     """Returns the default value of the given option."""
     return OPTIONS[option][0]
@@ -254,22 +291,22 @@ def message_printed_callback(data, buffer, date, tags, is_displayed,
     tags = parse_tags(tags)
     nick = nick_that_sent_message(tags, prefix)
 
-    if notification_should_be_sent(buffer, tags, nick, is_displayed, is_highlight, message):
+    # The minimal delay between notifications is applied when the queued
+    # notifications are sent, see queue_notification().
+    if notification_should_be_sent_disregarding_time(buffer, tags, nick,
+                                                     is_displayed, is_highlight, message):
         notification = prepare_notification(buffer, nick, message)
-        send_notification(notification)
+        queue_notification(buffer, notification)
 
     return weechat.WEECHAT_RC_OK
 
 
-def notification_should_be_sent(buffer, tags, nick, is_displayed, is_highlight, message):
-    """Should a notification be sent?"""
-    if notification_should_be_sent_disregarding_time(buffer, tags, nick,
-                                                     is_displayed, is_highlight, message):
-        # The following function should be called only when the notification
-        # should be sent (it updates the last notification time).
-        if not is_below_min_notification_delay(buffer):
-            return True
-    return False
+def buffer_closing_callback(data, signal, buffer):
+    """A callback when a buffer is being closed."""
+    # Queued notifications from the buffer cannot be sent anymore because the
+    # buffer will no longer be valid when they are due.
+    queued_notifications.pop(buffer, None)
+    return weechat.WEECHAT_RC_OK
 
 
 def notification_should_be_sent_disregarding_time(buffer, tags, nick,
@@ -320,38 +357,35 @@ def notification_should_be_sent_disregarding_time(buffer, tags, nick,
     return False
 
 
-def is_below_min_notification_delay(buffer):
-    """Is a notification in the given buffer below the minimal delay between
-    successive notifications from the same buffer?
-
-    When called, this function updates the time of the last notification.
+def earliest_notification_time(buffer):
+    """Returns the earliest time when a notification from the given buffer can
+    be sent without going below the minimal delay between successive
+    notifications from the same buffer.
     """
-    # We store the time of the last notification in a buffer-local variable to
-    # make it persistent over the lifetime of this script.
-    LAST_NOTIFICATION_TIME_VAR = 'notify_send_last_notification_time'
     last_notification_time = buffer_get_float(
         buffer,
         'localvar_' + LAST_NOTIFICATION_TIME_VAR
     )
 
     min_notification_delay = weechat.config_get_plugin('min_notification_delay')
-    # min_notification_delay is in milliseconds (str). To compare it with
+    # min_notification_delay is in milliseconds (str). To add it to
     # last_notification_time (float in seconds), we have to convert it to
     # seconds (float).
     min_notification_delay = float(min_notification_delay) / 1000
 
-    current_time = time.time()
+    return last_notification_time + min_notification_delay
 
-    # We have to update the last notification time before returning the result.
+
+def update_last_notification_time(buffer):
+    """Sets the time of the last notification from the given buffer to the
+    current time.
+    """
     buffer_set_float(
         buffer,
         'localvar_set_' + LAST_NOTIFICATION_TIME_VAR,
-        current_time
+        time.time()
     )
 
-    return (min_notification_delay > 0 and
-            current_time - last_notification_time < min_notification_delay)
-
 
 def buffer_get_float(buffer, property):
     """A variant of weechat.buffer_get_x() for floats.
@@ -458,16 +492,42 @@ def split_option_value(option, separator=','):
     return [value.strip() for value in values.split(separator)]
 
 
+def parsed_option_value(option, parse):
+    """Returns the value of the given option, split into a list, as returned
+    by the given function (e.g. a frozenset or a tuple of prefixes).
+
+    The parsed value is cached until an option of this script changes.
+    """
+    try:
+        return parsed_option_values[option]
+    except KeyError:
+        value = parse(split_option_value(option))
+        parsed_option_values[option] = value
+        return value
+
+
+def parse_prefixes(values):
+    """Parses the given list of prefixes into a tuple for str.startswith()."""
+    return tuple(value for value in values if value)
+
+
+def parse_patterns(values):
+    """Parses the given list of regex patterns into compiled regexes."""
+    return [re.compile(value) for value in values]
+
+
+def config_changed_callback(data, option, value):
+    """A callback when an option of this script is changed."""
+    parsed_option_values.clear()
+    return weechat.WEECHAT_RC_OK
+
+
 def ignore_notifications_from_messages_tagged_with(tags):
     """Should notifications be ignored for a message tagged with the given
     tags?
     """
-    ignored_tags = split_option_value('ignore_messages_tagged_with')
-    for ignored_tag in ignored_tags:
-        for tag in tags:
-            if tag == ignored_tag:
-                return True
-    return False
+    ignored_tags = parsed_option_value('ignore_messages_tagged_with', frozenset)
+    return not ignored_tags.isdisjoint(tags)
 
 
 def ignore_notifications_from_buffer(buffer):
@@ -478,26 +538,24 @@ def ignore_notifications_from_buffer(buffer):
         if buffer_name and buffer_name in ignored_buffers():
             return True
 
-    for buffer_name in buffer_names:
-        for prefix in ignored_buffer_prefixes():
-            if prefix and buffer_name.startswith(prefix):
+    prefixes = ignored_buffer_prefixes()
+    if prefixes:
+        for buffer_name in buffer_names:
+            if buffer_name.startswith(prefixes):
                 return True
 
     return False
 
 
 def ignored_buffers():
-    """A generator of buffers from which notifications should be ignored."""
-    for buffer in split_option_value('ignore_buffers'):
-        yield buffer
+    """A set of buffers from which notifications should be ignored."""
+    return parsed_option_value('ignore_buffers', frozenset)
 
 
 def ignored_buffer_prefixes():
-    """A generator of buffer prefixes from which notifications should be
-    ignored.
+    """A tuple of buffer prefixes from which notifications should be ignored.
     """
-    for prefix in split_option_value('ignore_buffers_starting_with'):
-        yield prefix
+    return parsed_option_value('ignore_buffers_starting_with', parse_prefixes)
 
 
 def ignore_notifications_from_nick(nick):
@@ -505,53 +563,53 @@ def ignore_notifications_from_nick(nick):
     if nick in ignored_nicks():
         return True
 
-    for prefix in ignored_nick_prefixes():
-        if prefix and nick.startswith(prefix):
-            return True
+    prefixes = ignored_nick_prefixes()
+    if prefixes and nick.startswith(prefixes):
+        return True
 
     return False
 
 
 def ignored_nicks():
-    """A generator of nicks from which notifications should be ignored."""
-    for nick in split_option_value('ignore_nicks'):
-        yield nick
+    """A set of nicks from which notifications should be ignored."""
+    return parsed_option_value('ignore_nicks', frozenset)
 
 
 def ignored_nick_prefixes():
-    """A generator of nick prefixes from which notifications should be
-    ignored.
-    """
-    for prefix in split_option_value('ignore_nicks_starting_with'):
-        yield prefix
+    """A tuple of nick prefixes from which notifications should be ignored."""
+    return parsed_option_value('ignore_nicks_starting_with', parse_prefixes)
 
 
 def notify_on_messages_that_match(message):
     """Should we send a notification for the given message, provided it matches
     any of the requested patterns?
     """
-    message_patterns = split_option_value('notify_on_messages_that_match')
+    message_patterns = parsed_option_value(
+        'notify_on_messages_that_match',
+        parse_patterns
+    )
     for pattern in message_patterns:
-        if re.search(pattern, message):
+        if pattern.search(message):
             return True
 
     return False
 
 
 def buffers_to_notify_on_all_messages():
-    """A generator of buffer names in which the user wants to be notified for
-    all messages.
+    """A set of buffer names in which the user wants to be notified for all
+    messages.
     """
-    for buffer in split_option_value('notify_on_all_messages_in_buffers'):
-        yield buffer
+    return parsed_option_value('notify_on_all_messages_in_buffers', frozenset)
 
 
 def buffer_patterns_to_notify_on_all_messages():
-    """A generator of buffer-name patterns in which the user wants to be
-    notifier for all messages.
+    """A list of compiled buffer-name patterns in which the user wants to be
+    notified for all messages.
     """
-    for pattern in split_option_value('notify_on_all_messages_in_buffers_that_match'):
-        yield pattern
+    return parsed_option_value(
+        'notify_on_all_messages_in_buffers_that_match',
+        parse_patterns
+    )
 
 
 def notify_on_all_messages_in_buffer(buffer):
@@ -560,25 +618,28 @@ def notify_on_all_messages_in_buffer(buffer):
     buffer_names = names_for_buffer(buffer)
 
     # Option notify_on_all_messages_in_buffers:
-    for buf in buffers_to_notify_on_all_messages():
-        if buf in buffer_names:
+    buffers = buffers_to_notify_on_all_messages()
+    for buf in buffer_names:
+        if buf in buffers:
             return True
 
     # Option notify_on_all_messages_in_buffers_that_match:
     for pattern in buffer_patterns_to_notify_on_all_messages():
         for buf in buffer_names:
-            if re.search(pattern, buf):
+            if pattern.search(buf):
                 return True
 
     return False
 
 
 def buffer_patterns_to_hide_messages():
-    """A generator of buffer-name patterns in which the user wants to hide
+    """A list of compiled buffer-name patterns in which the user wants to hide
     messages.
     """
-    for pattern in split_option_value('hide_messages_in_buffers_that_match'):
-        yield pattern
+    return parsed_option_value(
+        'hide_messages_in_buffers_that_match',
+        parse_patterns
+    )
 
 
 def hide_message_in_buffer(buffer):
@@ -587,7 +648,7 @@ def hide_message_in_buffer(buffer):
 
     for pattern in buffer_patterns_to_hide_messages():
         for buf in buffer_names:
-            if re.search(pattern, buf):
+            if pattern.search(buf):
                 return True
 
     return False
@@ -605,16 +666,6 @@ def prepare_notification(buffer, nick, message):
     if hide_message_in_buffer(buffer):
         message = ''
 
-    max_length = int(weechat.config_get_plugin('max_length'))
-    if max_length > 0:
-        ellipsis = weechat.config_get_plugin('ellipsis')
-        message = shorten_message(message, max_length, ellipsis)
-
-    if weechat.config_get_plugin('escape_html') == 'on':
-        message = escape_html(message)
-
-    message = escape_slashes(message)
-
     icon = weechat.config_get_plugin('icon')
     desktop_entry = weechat.config_get_plugin('desktop_entry')
     timeout = weechat.config_get_plugin('timeout')
@@ -637,6 +688,21 @@ def nick_separator():
     return separator if separator else default_value_of('nick_separator')
 
 
+def shorten_and_escape_message(message):
+    """Shortens and escapes the given message of a notification according to
+    the options.
+    """
+    max_length = int(weechat.config_get_plugin('max_length'))
+    if max_length > 0:
+        ellipsis = weechat.config_get_plugin('ellipsis')
+        message = shorten_message(message, max_length, ellipsis)
+
+    if weechat.config_get_plugin('escape_html') == 'on':
+        message = escape_html(message)
+
+    return escape_slashes(message)
+
+
 def shorten_message(message, max_length, ellipsis):
     """Shortens the message to at most max_length characters by using the given
     ellipsis.
@@ -697,8 +763,111 @@ def escape_slashes(message):
     return message.replace('\\', r'\\')
 
 
+def queue_notification(buffer, notification):
+    """Queues the given notification from the given buffer to be sent later.
+
+    Notifications are sent from a timer so that a burst of notifications from
+    the same buffer results in a single summary notification. They are sent
+    after the batch delay, but not before the minimal delay since the last
+    notification from the buffer has passed.
+    """
+    if buffer in queued_notifications:
+        count, _, send_time = queued_notifications[buffer]
+        queued_notifications[buffer] = (count + 1, notification, send_time)
+        return
+
+    current_time = time.time()
+    batch_delay = float(weechat.config_get_plugin('batch_delay')) / 1000
+    send_time = max(
+        current_time + batch_delay,
+        earliest_notification_time(buffer)
+    )
+    if send_time <= current_time:
+        send_buffer_notifications(buffer, 1, notification)
+        return
+
+    max_queued = int(weechat.config_get_plugin('max_queued_notifications'))
+    while max_queued > 0 and len(queued_notifications) >= max_queued:
+        queued_notifications.popitem(last=False)
+    queued_notifications[buffer] = (1, notification, send_time)
+    schedule_queued_notifications()
+
+
+def schedule_queued_notifications():
+    """Ensures that the timer that sends the queued notifications fires when
+    the earliest of them should be sent.
+    """
+    global send_queued_notifications_timer
+    global send_queued_notifications_time
+
+    if not queued_notifications:
+        return
+
+    send_time = min(
+        send_time for _, _, send_time in queued_notifications.values()
+    )
+    if send_queued_notifications_timer is not None:
+        if send_queued_notifications_time <= send_time:
+            return
+        weechat.unhook(send_queued_notifications_timer)
+
+    delay = int((send_time - time.time()) * 1000) + 1
+    send_queued_notifications_timer = weechat.hook_timer(
+        max(delay, 1), 0, 1, 'send_queued_notifications_callback', ''
+    )
+    send_queued_notifications_time = send_time
+
+
+def send_queued_notifications_callback(data, remaining_calls):
+    """A callback of the timer that sends the queued notifications."""
+    global send_queued_notifications_timer
+    send_queued_notifications_timer = None
+
+    current_time = time.time()
+    for buffer, (count, notification, send_time) in list(queued_notifications.items()):
+        if send_time <= current_time:
+            del queued_notifications[buffer]
+            send_buffer_notifications(buffer, count, notification)
+
+    schedule_queued_notifications()
+    return weechat.WEECHAT_RC_OK
+
+
+def send_buffer_notifications(buffer, count, last_notification):
+    """Sends the given number of notifications from the given buffer, of
+    which last_notification is the last one.
+    """
+    if count > 1:
+        notification = summarize_notifications(count, last_notification)
+    else:
+        notification = last_notification
+    notification.message = shorten_and_escape_message(notification.message)
+    update_last_notification_time(buffer)
+    send_notification(notification)
+
+
+def summarize_notifications(count, last_notification):
+    """Returns a notification summarizing the given number of notifications
+    from a single buffer, of which last_notification is the last one.
+    """
+    message = '({} messages) {}'.format(count, last_notification.message)
+    return Notification(
+        last_notification.source,
+        message.strip(),
+        last_notification.icon,
+        last_notification.desktop_entry,
+        last_notification.timeout,
+        last_notification.transient,
+        last_notification.urgency
+    )
+
+
 def send_notification(notification):
-    """Sends the given notification to the user."""
+    """Sends the given notification to the user.
+
+    notify-send is run through hook_process_hashtable(), so this function
+    returns without waiting for it to finish.
+    """
     notify_cmd = ['notify-send', '--app-name', 'weechat']
     if notification.icon:
         notify_cmd += ['--icon', notification.icon]
@@ -721,25 +890,33 @@ def send_notification(notification):
         notification.message
     ]
 
-    # Prevent notify-send from messing up the WeeChat screen when occasionally
-    # emitting assertion messages by redirecting the output to /dev/null (users
-    # would need to run /redraw to fix the screen).
-    # In Python < 3.3, there is no subprocess.DEVNULL, so we have to use a
-    # workaround.
-    with open(os.devnull, 'wb') as devnull:
-        try:
-            subprocess.check_call(
-                notify_cmd,
-                stderr=subprocess.STDOUT,
-                stdout=devnull,
-            )
-        except Exception as ex:
-            error_message = '{} (reason: {!r}). {}'.format(
-                'Failed to send the notification via notify-send',
-                '{}: {}'.format(ex.__class__.__name__, ex),
-                'Ensure that you have notify-send installed in your system.',
-            )
-            print(error_message, file=sys.stderr)
+    # Passing the arguments as arg1, arg2, ... makes WeeChat run the command
+    # directly instead of through a shell, so no escaping is needed. The
+    # output of notify-send is captured by WeeChat, so it cannot mess up the
+    # WeeChat screen.
+    options = dict(
+        ('arg{}'.format(i), arg) for i, arg in enumerate(notify_cmd[1:], 1)
+    )
+    weechat.hook_process_hashtable(
+        notify_cmd[0],
+        options,
+        NOTIFY_SEND_TIMEOUT,
+        'notification_sent_callback',
+        ''
+    )
+
+
+def notification_sent_callback(data, command, return_code, out, err):
+    """A callback when notify-send has finished."""
+    if return_code == weechat.WEECHAT_HOOK_PROCESS_ERROR or return_code > 0:
+        reason = err.strip() or 'exit code {}'.format(return_code)
+        error_message = '{} (reason: {!r}). {}'.format(
+            'Failed to send the notification via notify-send',
+            reason,
+            'Ensure that you have notify-send installed in your system.',
+        )
+        print(error_message, file=sys.stderr)
+    return weechat.WEECHAT_RC_OK
 
 
 if __name__ == '__main__':
@@ -761,6 +938,16 @@ if __name__ == '__main__':
         if not weechat.config_is_set_plugin(option):
             weechat.config_set_plugin(option, default_value)
 
+    # Forget the parsed option values whenever an option changes.
+    weechat.hook_config(
+        'plugins.var.python.{}.*'.format(SCRIPT_NAME),
+        'config_changed_callback',
+        ''
+    )
+
     # Catch all messages on all buffers and strip colors from them before
     # passing them into the callback.
     weechat.hook_print('', '', '', 1, 'message_printed_callback', '')
+
+    # Drop the queued notifications from buffers that are being closed.
+    weechat.hook_signal('buffer_closing', 'buffer_closing_callback', '')
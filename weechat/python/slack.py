@@ -6,17 +6,20 @@ from __future__ import annotations
 import ast
 import hashlib
 import json
+import logging
+import logging.handlers
 import os
 import pprint
 import re
-import resource
 import socket
+import sqlite3
 import ssl
 import sys
 import time
 import traceback
 from abc import ABC, abstractmethod
-from collections import OrderedDict, defaultdict
+from bisect import bisect_left, bisect_right, insort
+from collections import OrderedDict, defaultdict, deque
 from contextlib import contextmanager
 from dataclasses import dataclass, field
 from datetime import date, datetime, timedelta
@@ -27,9 +30,11 @@ from itertools import chain, islice
 from typing import (
     TYPE_CHECKING,
     Any,
+    AsyncGenerator,
     Awaitable,
     Callable,
     Coroutine,
+    Deque,
     Dict,
     Generator,
     Generic,
@@ -38,6 +43,7 @@ from typing import (
     List,
     Mapping,
     Match,
+    MutableMapping,
     NoReturn,
     Optional,
     Sequence,
@@ -51,6 +57,7 @@ from typing import (
 )
 from urllib.parse import quote, unquote, urlencode
 from uuid import uuid4
+from weakref import WeakSet
 
 import weechat
 from websocket import (
@@ -209,19 +216,28 @@ class Shared:
     def __init__(self):
         self.SCRIPT_NAME = "slack"
         self.SCRIPT_VERSION = "3.0.0"
+        self.script_load_start_time = time.perf_counter()
+        self.startup_timings: List[Tuple[str, float]] = []
 
         self.weechat_version: int
         self.weechat_callbacks: Dict[str, Callable[..., WeechatCallbackReturnType]]
         self.active_tasks: Dict[str, List[Task[object]]] = defaultdict(list)
         self.active_futures: Dict[str, Future[object]] = {}
+        self.http_request_semaphore: Semaphore
+        self.http_requests_in_flight: Dict[
+            Tuple[str, Tuple[Tuple[str, str], ...]], Task[str]
+        ] = {}
+        self.http_requests_coalesced_count = 0
+        self.cache: SlackCache
+        # Increased when all nicks must be computed again
+        self.nick_generation = 0
         self.buffers: Dict[str, Union[SlackWorkspace, SlackMessageBuffer]] = {}
         self.workspaces: Dict[str, SlackWorkspace] = {}
         self.current_buffer_pointer: str
         self.config: SlackConfig
         self.commands: Dict[str, Command] = {}
         self.uncaught_errors: List[UncaughtError] = []
-        self.standard_emojis: Dict[str, Emoji]
-        self.standard_emojis_inverse: Dict[str, Emoji]
+        self.standard_emojis: EmojiStore
         self.highlight_tag = "highlight"
         self.debug_buffer_pointer: Optional[str] = None
         self.script_is_unloading = False
@@ -388,6 +404,14 @@ def weechat_task_cb(data: str, *args: object) -> int:
     return weechat.WEECHAT_RC_OK
 
 
+def resolve_future(future: Future[T], result: T):
+    shared.active_futures.pop(future.id, None)
+    future.set_result(result)
+    tasks = shared.active_tasks.pop(future.id, [])
+    for task in tasks:
+        task_runner(task)
+
+
 def process_ended_task(task: Task[Any]):
     if task.id in shared.active_tasks:
         tasks = shared.active_tasks.pop(task.id)
@@ -490,6 +514,99 @@ async def sleep(milliseconds: int):
     return await future
 
 
+class Semaphore:
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self._waiters: Deque[Future[None]] = deque()
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    def set_limit(self, limit: int):
+        self.limit = limit
+        self._wake_waiters()
+
+    async def acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            return
+        future: Future[None] = Future()
+        self._waiters.append(future)
+        try:
+            await future
+        except BaseException:
+            # The waiting task was cancelled, so give up the place in the
+            # queue, or the slot if it was already handed over
+            if future.done():
+                self.release()
+            else:
+                self._waiters.remove(future)
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._wake_waiters()
+
+    def _wake_waiters(self):
+        while self._waiters and self.active < self.limit:
+            future = self._waiters.popleft()
+            self.active += 1
+            resolve_future(future, None)
+
+    async def __aenter__(self):
+        await self.acquire()
+
+    async def __aexit__(self, *args: object):
+        self.release()
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: int, burst: int):
+        self.requests_per_minute = requests_per_minute
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated_time = time.time()
+        self._blocked_until = 0.0
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(
+            self.burst,
+            self._tokens + (now - self._updated_time) * self.requests_per_minute / 60,
+        )
+        self._updated_time = now
+
+    def charge(self, tokens: int = 1):
+        # May go below zero if requests are charged without waiting for a token
+        self._refill()
+        self._tokens -= tokens
+
+    def penalize(self, seconds: int):
+        self._refill()
+        self._blocked_until = max(self._blocked_until, time.time() + seconds)
+        self._tokens = min(self._tokens, 0)
+
+    async def wait(self):
+        while True:
+            self._refill()
+            now = time.time()
+            if now < self._blocked_until:
+                wait_seconds = self._blocked_until - now
+            elif self._tokens >= 1:
+                return
+            else:
+                wait_seconds = (1 - self._tokens) * 60 / self.requests_per_minute
+            await sleep(int(wait_seconds * 1000))
+
+    async def acquire(self):
+        # Nothing is awaited between getting the token and charging it, so
+        # concurrent requests can't take the same token
+        await self.wait()
+        self.charge()
+
+
 if TYPE_CHECKING:
     pass
     pass
@@ -611,46 +728,60 @@ class MessagePriority(Enum):
 class SlackTs(str):
     def __init__(self, ts: str):
         self.major, self.minor = [int(x) for x in ts.split(".", 1)]
+        # Both parts packed in one int, so comparing two SlackTs is a single
+        # int comparison
+        self.key = (self.major << 64) | self.minor
 
     def __hash__(self) -> int:
-        return hash((self.major, self.minor))
+        return hash(self.key)
 
     def __repr__(self) -> str:
         return f"SlackTs('{self}')"
 
-    def _cmp(self, other: object) -> int:
-        if isinstance(other, str):
-            other = SlackTs(other)
-        if not isinstance(other, SlackTs):
-            return NotImplemented
-        elif self.major > other.major:
-            return 1
-        elif self.major < other.major:
-            return -1
-        elif self.minor > other.minor:
-            return 1
-        elif self.minor < other.minor:
-            return -1
+    @staticmethod
+    def _other_key(other: object) -> Optional[int]:
+        if isinstance(other, SlackTs):
+            return other.key
+        elif isinstance(other, str):
+            return SlackTs(other).key
         else:
-            return 0
+            return None
 
     def __eq__(self, other: object) -> bool:
-        return self._cmp(other) == 0
+        other_key = self._other_key(other)
+        if other_key is None:
+            return NotImplemented
+        return self.key == other_key
 
     def __ne__(self, other: object) -> bool:
-        return self._cmp(other) != 0
+        other_key = self._other_key(other)
+        if other_key is None:
+            return NotImplemented
+        return self.key != other_key
 
     def __gt__(self, other: object) -> bool:
-        return self._cmp(other) == 1
+        other_key = self._other_key(other)
+        if other_key is None:
+            return NotImplemented
+        return self.key > other_key
 
     def __ge__(self, other: object) -> bool:
-        return self._cmp(other) >= 0
+        other_key = self._other_key(other)
+        if other_key is None:
+            return NotImplemented
+        return self.key >= other_key
 
     def __lt__(self, other: object) -> bool:
-        return self._cmp(other) == -1
+        other_key = self._other_key(other)
+        if other_key is None:
+            return NotImplemented
+        return self.key < other_key
 
     def __le__(self, other: object) -> bool:
-        return self._cmp(other) <= 0
+        other_key = self._other_key(other)
+        if other_key is None:
+            return NotImplemented
+        return self.key <= other_key
 
 
 class PendingMessageItem:
@@ -674,6 +805,17 @@ class PendingMessageItem:
         self.fallback_name = fallback_name
         self.file = file
 
+        if (
+            item_type == "conversation"
+            or item_type == "user"
+            or item_type == "usergroup"
+        ):
+            message.workspace.add_render_dependency(item_type, item_id, message)
+        elif item_type == "message_nick" and message.sender_user_id:
+            message.workspace.add_render_dependency(
+                "user", message.sender_user_id, message
+            )
+
     def __repr__(self):
         return f"{self.__class__.__name__}({self.message}, {self.item_type}, {self.item_id}, {self.display_type})"
 
@@ -749,10 +891,7 @@ class PendingMessageItem:
 
         elif self.item_type == "file":
             if self.file is None or self.file.get("file_access") == "check_file_info":
-                file_response = await self.message.workspace.api.fetch_files_info(
-                    self.item_id
-                )
-                file = file_response["file"]
+                file = await self.message.workspace.fetch_file_info(self.item_id)
             else:
                 file = self.file
 
@@ -815,13 +954,20 @@ class SlackMessage:
     def __init__(self, conversation: SlackConversation, message_json: SlackMessageDict):
         self._message_json = message_json
         self._rendered_prefix = None
-        self._rendered_message = None
+        # The rendered message is cached in segments which are invalidated
+        # separately, so e.g. a reaction doesn't cause the text to be rendered
+        self._rendered_text: Optional[str] = None
+        self._rendered_reactions: Optional[str] = None
+        # Increased when a segment is invalidated
+        self._render_version = 0
         self._parsed_message: Optional[List[Union[str, PendingMessageItem]]] = None
         self.conversation = conversation
         self.ts = SlackTs(message_json["ts"])
         self.replies_tss: List[SlackTs] = []
         self._replies = SlackMessageReplies(self)
         self.reply_history_filled = False
+        # The latest_reply and reply_count when the replies were last fetched
+        self.replies_fetched_state: Optional[Tuple[Optional[SlackTs], int]] = None
         self.thread_buffer: Optional[SlackThread] = None
         self._deleted = False
 
@@ -894,6 +1040,10 @@ class SlackMessage:
         if "latest_reply" in self._message_json:
             return SlackTs(self._message_json["latest_reply"])
 
+    @property
+    def reply_count(self) -> int:
+        return self._message_json.get("reply_count", 0)
+
     @property
     def replies(self) -> Mapping[SlackTs, SlackMessage]:
         return self._replies
@@ -939,21 +1089,31 @@ class SlackMessage:
     @deleted.setter
     def deleted(self, value: bool):
         self._deleted = value
-        self._rendered_message = None
+        self._rendered_text = None
+        self._render_version += 1
         self._parsed_message = None
 
     def update_message_json(self, message_json: SlackMessageDict):
         self._message_json.update(message_json)  # pyright: ignore [reportArgumentType, reportCallIssue]
         self._rendered_prefix = None
-        self._rendered_message = None
-        self._parsed_message = None
+        self.invalidate_rendered_message()
 
     def update_message_json_room(self, room: SlackMessageSubtypeHuddleThreadRoom):
         if "room" in self._message_json:
             self._message_json["room"] = room
-        self._rendered_message = None
+        self._rendered_text = None
+        self._render_version += 1
         self._parsed_message = None
 
+    def invalidate_rendered_message(self, reparse: bool = True, prefix: bool = False):
+        self._rendered_text = None
+        self._rendered_reactions = None
+        self._render_version += 1
+        if reparse:
+            self._parsed_message = None
+        if prefix:
+            self._rendered_prefix = None
+
     async def update_subscribed(
         self, subscribed: bool, subscription: SlackThreadSubscription
     ):
@@ -978,14 +1138,16 @@ class SlackMessage:
             self._message_json["reactions"].append(
                 {"name": reaction_name, "users": [user_id], "count": 1}
             )
-        self._rendered_message = None
+        self._rendered_reactions = None
+        self._render_version += 1
 
     def reaction_remove(self, reaction_name: str, user_id: str):
         reaction = self._get_reaction(reaction_name)
         if reaction and user_id in reaction["users"]:
             reaction["users"].remove(user_id)
             reaction["count"] -= 1
-            self._rendered_message = None
+            self._rendered_reactions = None
+            self._render_version += 1
 
     def has_reacted(self, reaction_name: str) -> bool:
         reaction = self._get_reaction(reaction_name)
@@ -1118,6 +1280,9 @@ class SlackMessage:
             )
             return get_user_nick(nick, is_self=self.is_self_msg)
         if "user" in self._message_json:
+            self.workspace.add_render_dependency(
+                "user", self._message_json["user"], self
+            )
             try:
                 user = await self.workspace.users[self._message_json["user"]]
                 return user.nick
@@ -1235,40 +1400,50 @@ class SlackMessage:
 
         return self._parsed_message
 
+    async def _render_text(self, rerender: bool = False) -> str:
+        me_prefix = (
+            f"{(await self.nick()).format(colorize=True)} "
+            if self._message_json.get("subtype") == "me_message"
+            else ""
+        )
+
+        parsed_message = self.parse_message_text(rerender)
+        text = "".join(
+            [
+                text if isinstance(text, str) else await text.resolve()
+                for text in parsed_message
+            ]
+        )
+        text_edited = (
+            f" {with_color(shared.config.color.edited_message_suffix.value, '(edited)')}"
+            if self._message_json.get("edited")
+            else ""
+        )
+        return me_prefix + text + text_edited
+
     async def _render_message(self, rerender: bool = False) -> str:
-        if self._rendered_message is not None and not rerender:
-            return self._rendered_message
+        # The message may be changed while rendering, in which case the
+        # segments rendered here are returned, but not cached
+        render_version = self._render_version
+        rendered_text = None if rerender else self._rendered_text
+        rendered_reactions = None if rerender else self._rendered_reactions
 
         try:
-            me_prefix = (
-                f"{(await self.nick()).format(colorize=True)} "
-                if self._message_json.get("subtype") == "me_message"
-                else ""
-            )
-
-            parsed_message = self.parse_message_text(rerender)
-            text = "".join(
-                [
-                    text if isinstance(text, str) else await text.resolve()
-                    for text in parsed_message
-                ]
-            )
-            text_edited = (
-                f" {with_color(shared.config.color.edited_message_suffix.value, '(edited)')}"
-                if self._message_json.get("edited")
-                else ""
-            )
-            reactions = await self._create_reactions_string()
-            self._rendered_message = me_prefix + text + text_edited + reactions
+            if rendered_text is None:
+                rendered_text = await self._render_text(rerender)
+            if rendered_reactions is None:
+                rendered_reactions = await self._create_reactions_string()
         except Exception as e:
             uncaught_error = UncaughtError(e)
             print_error(store_and_format_uncaught_error(uncaught_error))
             text = f"<Error rendering message {self.ts}, error id: {uncaught_error.id}>"
-            self._rendered_message = with_color(
-                shared.config.color.render_error.value, text
-            )
+            rendered_text = with_color(shared.config.color.render_error.value, text)
+            rendered_reactions = ""
 
-        return self._rendered_message
+        if self._render_version == render_version:
+            self._rendered_text = rendered_text
+            self._rendered_reactions = rendered_reactions
+        return rendered_text + rendered_reactions
 
     async def render_message(
         self,
@@ -1345,6 +1520,8 @@ class SlackMessage:
 
     async def _create_reaction_string(self, reaction: SlackMessageReaction) -> str:
         if self.conversation.display_reaction_nicks():
+            for user_id in reaction["users"]:
+                self.workspace.add_render_dependency("user", user_id, self)
             users = await gather(
                 *(self.workspace.users[user_id] for user_id in reaction["users"])
             )
@@ -1839,6 +2016,48 @@ class SlackMessage:
         return [item for items in intersperse(attachments, ["\n"]) for item in items]
 
 
+class SlackMessageStore(MutableMapping[SlackTs, SlackMessage]):
+    """The messages of a conversation, iterated in ts order.
+
+    The timestamps are kept in a sorted list next to the dict, so adding a
+    message is a bisect instead of sorting all the messages again.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._messages: Dict[SlackTs, SlackMessage] = {}
+        self._sorted_tss: List[SlackTs] = []
+
+    def __getitem__(self, key: SlackTs) -> SlackMessage:
+        return self._messages[key]
+
+    def __setitem__(self, key: SlackTs, value: SlackMessage):
+        if key not in self._messages:
+            if not self._sorted_tss or self._sorted_tss[-1] < key:
+                self._sorted_tss.append(key)
+            else:
+                insort(self._sorted_tss, key)
+        self._messages[key] = value
+
+    def __delitem__(self, key: SlackTs):
+        del self._messages[key]
+        del self._sorted_tss[bisect_left(self._sorted_tss, key)]
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._messages
+
+    def __iter__(self) -> Iterator[SlackTs]:
+        return iter(self._sorted_tss)
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def values_after(self, ts: Optional[SlackTs]) -> Iterator[SlackMessage]:
+        start = bisect_right(self._sorted_tss, ts) if ts is not None else 0
+        for index in range(start, len(self._sorted_tss)):
+            yield self._messages[self._sorted_tss[index]]
+
+
 class SlackMessageReplies(Mapping[SlackTs, SlackMessage]):
     def __init__(self, parent: SlackMessage):
         super().__init__()
@@ -1866,6 +2085,15 @@ if TYPE_CHECKING:
     pass
 
 
+def buffer_hotlist_priority(buffer_pointer: str) -> Optional[int]:
+    hotlist = weechat.hdata_pointer(
+        weechat.hdata_get("buffer"), buffer_pointer, "hotlist"
+    )
+    if not hotlist:
+        return None
+    return weechat.hdata_integer(weechat.hdata_get("hotlist"), hotlist, "priority")
+
+
 def hdata_line_ts(line_pointer: str) -> Optional[SlackTs]:
     data = weechat.hdata_pointer(weechat.hdata_get("line"), line_pointer, "data")
     for i in range(
@@ -1887,43 +2115,63 @@ def tags_set_notify_none(tags: List[str]) -> List[str]:
     return tags
 
 
-def modify_buffer_line(buffer_pointer: str, ts: SlackTs, new_text: str):
+def modify_buffer_line(
+    buffer_pointer: str,
+    ts: SlackTs,
+    new_text: str,
+    line_pointers: Optional[List[str]] = None,
+):
+    # line_pointers are the lines of the message in order if already known, which
+    # avoids searching the buffer. Any lines appended for the message are added to it.
     if not buffer_pointer:
         return False
 
     own_lines = weechat.hdata_pointer(
         weechat.hdata_get("buffer"), buffer_pointer, "own_lines"
     )
-    line_pointer = weechat.hdata_pointer(
+    last_line_pointer = weechat.hdata_pointer(
         weechat.hdata_get("lines"), own_lines, "last_line"
     )
 
-    # Find the last line with this ts
-    is_last_line = True
-    while line_pointer and hdata_line_ts(line_pointer) != ts:
-        is_last_line = False
-        line_pointer = weechat.hdata_move(weechat.hdata_get("line"), line_pointer, -1)
+    if line_pointers:
+        pointers = line_pointers
+        is_last_line = pointers[-1] == last_line_pointer
+    else:
+        line_pointer = last_line_pointer
+
+        # Find the last line with this ts
+        is_last_line = True
+        while line_pointer and hdata_line_ts(line_pointer) != ts:
+            is_last_line = False
+            line_pointer = weechat.hdata_move(
+                weechat.hdata_get("line"), line_pointer, -1
+            )
+
+        if not line_pointer:
+            return False
 
-    if not line_pointer:
-        return False
+        if shared.weechat_version >= 0x04000000:
+            pointers = [line_pointer]
+        else:
+            # Find all lines for the message
+            pointers = []
+            while line_pointer and hdata_line_ts(line_pointer) == ts:
+                pointers.append(line_pointer)
+                line_pointer = weechat.hdata_move(
+                    weechat.hdata_get("line"), line_pointer, -1
+                )
+            pointers.reverse()
+
+            if not pointers:
+                return False
 
     if shared.weechat_version >= 0x04000000:
-        data = weechat.hdata_pointer(weechat.hdata_get("line"), line_pointer, "data")
+        data = weechat.hdata_pointer(weechat.hdata_get("line"), pointers[-1], "data")
         weechat.hdata_update(
             weechat.hdata_get("line_data"), data, {"message": new_text}
         )
         return True
 
-    # Find all lines for the message
-    pointers: List[str] = []
-    while line_pointer and hdata_line_ts(line_pointer) == ts:
-        pointers.append(line_pointer)
-        line_pointer = weechat.hdata_move(weechat.hdata_get("line"), line_pointer, -1)
-    pointers.reverse()
-
-    if not pointers:
-        return False
-
     if is_last_line:
         lines = new_text.split("\n")
         extra_lines_count = len(lines) - len(pointers)
@@ -1974,6 +2222,9 @@ def modify_buffer_line(buffer_pointer: str, ts: SlackTs, new_text: str):
     return True
 
 
+RECENT_SENDERS_MAX = 200
+
+
 class SlackMessageBuffer(ABC):
     def __init__(self):
         self._typing_self_last_sent = 0
@@ -1984,6 +2235,11 @@ class SlackMessageBuffer(ABC):
         self.history_needs_refresh = False
         self.last_printed_ts: Optional[SlackTs] = None
         self.hotlist_tss: Set[SlackTs] = set()
+        # Pointers to the lines printed for each ts, in the order they were printed
+        self._line_pointers: Dict[SlackTs, List[str]] = {}
+        self._first_line_pointer: Optional[str] = None
+        # Ids of the users who sent the last printed messages, most recent last
+        self.recent_senders: OrderedDict[str, None] = OrderedDict()
 
         self.completion_context: Literal[
             "NO_COMPLETION",
@@ -2101,43 +2357,126 @@ class SlackMessageBuffer(ABC):
     async def set_hotlist(self) -> None:
         raise NotImplementedError()
 
+    def _own_lines_pointer(self, name: str) -> str:
+        own_lines = weechat.hdata_pointer(
+            weechat.hdata_get("buffer"), self.buffer_pointer, "own_lines"
+        )
+        return weechat.hdata_pointer(weechat.hdata_get("lines"), own_lines, name)
+
+    def _add_printed_lines(self, ts: SlackTs, prev_last_line_pointer: str):
+        pointers: List[str] = []
+        line_pointer = self._own_lines_pointer("last_line")
+        while line_pointer and line_pointer != prev_last_line_pointer:
+            if hdata_line_ts(line_pointer) == ts:
+                pointers.append(line_pointer)
+            line_pointer = weechat.hdata_move(
+                weechat.hdata_get("line"), line_pointer, -1
+            )
+        pointers.reverse()
+        if pointers:
+            self._line_pointers.setdefault(ts, []).extend(pointers)
+        if self._first_line_pointer is None:
+            self._first_line_pointer = self._own_lines_pointer("first_line")
+
+    def _remove_freed_line_pointers(self):
+        # WeeChat frees the oldest lines when the buffer reaches its history
+        # limits, so drop the pointers for all lines before the first line
+        first_line_pointer = self._own_lines_pointer("first_line")
+        if first_line_pointer == self._first_line_pointer:
+            return
+        self._first_line_pointer = first_line_pointer
+
+        line_pointer = first_line_pointer
+        first_ts = None
+        while line_pointer and first_ts is None:
+            first_ts = hdata_line_ts(line_pointer)
+            if first_ts is None:
+                line_pointer = weechat.hdata_move(
+                    weechat.hdata_get("line"), line_pointer, 1
+                )
+
+        if first_ts is None:
+            self._line_pointers.clear()
+            return
+
+        for ts in list(self._line_pointers):
+            if ts >= first_ts:
+                break
+            del self._line_pointers[ts]
+
+        pointers = self._line_pointers.get(first_ts)
+        if pointers and line_pointer in pointers:
+            del pointers[: pointers.index(line_pointer)]
+
+    def line_pointers_for_ts(self, ts: SlackTs) -> Optional[List[str]]:
+        if self.buffer_pointer is None:
+            return None
+        self._remove_freed_line_pointers()
+        return self._line_pointers.get(ts)
+
+    def clear_line_pointers(self):
+        self._line_pointers.clear()
+        self._first_line_pointer = None
+
+    def modify_buffer_line(self, ts: SlackTs, new_text: str) -> bool:
+        if self.buffer_pointer is None:
+            return False
+
+        line_pointers = self.line_pointers_for_ts(ts)
+        return modify_buffer_line(self.buffer_pointer, ts, new_text, line_pointers)
+
+    def modify_buffer_line_prefix(self, ts: SlackTs, new_prefix: str) -> bool:
+        line_pointers = self.line_pointers_for_ts(ts)
+        if not line_pointers:
+            return False
+
+        # The prefix is only set on the first line of the message
+        data = weechat.hdata_pointer(
+            weechat.hdata_get("line"), line_pointers[0], "data"
+        )
+        prefix = weechat.hdata_string(weechat.hdata_get("line_data"), data, "prefix")
+        if prefix != new_prefix:
+            weechat.hdata_update(
+                weechat.hdata_get("line_data"), data, {"prefix": new_prefix}
+            )
+        return True
+
     async def rerender_message(self, message: SlackMessage):
         if self.buffer_pointer is None:
             return
 
-        new_text = await message.render_message(context=self.context, rerender=True)
-        modify_buffer_line(self.buffer_pointer, message.ts, new_text)
+        # The parts of the message which changed have been invalidated, so
+        # only they are rendered again
+        new_text = await message.render_message(context=self.context)
+        self.modify_buffer_line(message.ts, new_text)
+        new_prefix = await message.render_prefix()
+        self.modify_buffer_line_prefix(message.ts, new_prefix)
 
     async def rerender_history(self):
         if self.buffer_pointer is None:
             return
 
         if shared.weechat_version >= 0x04000000:
-            own_lines = weechat.hdata_pointer(
-                weechat.hdata_get("buffer"), self.buffer_pointer, "own_lines"
-            )
-            line_pointer = weechat.hdata_pointer(
-                weechat.hdata_get("lines"), own_lines, "last_line"
-            )
-
-            while line_pointer:
-                ts = hdata_line_ts(line_pointer)
-                if ts:
-                    message = self.messages[ts]
-                    new_text = await message.render_message(
-                        context=self.context, rerender=True
-                    )
-                    data = weechat.hdata_pointer(
-                        weechat.hdata_get("line"), line_pointer, "data"
-                    )
-                    weechat.hdata_update(
-                        weechat.hdata_get("line_data"), data, {"message": new_text}
-                    )
-                    line_pointer = weechat.hdata_move(
-                        weechat.hdata_get("line"), line_pointer, -1
-                    )
+            self._remove_freed_line_pointers()
+            for ts, pointers in list(self._line_pointers.items()):
+                message = self.messages.get(ts)
+                if message is None:
+                    # The message has been removed from memory
+                    continue
+                new_text = await message.render_message(
+                    context=self.context, rerender=True
+                )
+                if self.buffer_pointer is None:
+                    return
+                data = weechat.hdata_pointer(
+                    weechat.hdata_get("line"), pointers[-1], "data"
+                )
+                weechat.hdata_update(
+                    weechat.hdata_get("line_data"), data, {"message": new_text}
+                )
         else:
             for message in self.messages.values():
+                message.invalidate_rendered_message()
                 await self.rerender_message(message)
 
     def set_typing_self(self):
@@ -2152,7 +2491,7 @@ class SlackMessageBuffer(ABC):
 
         if self.last_printed_ts is not None and message.ts <= self.last_printed_ts:
             new_text = await message.render_message(context=self.context, rerender=True)
-            did_update = modify_buffer_line(self.buffer_pointer, message.ts, new_text)
+            did_update = self.modify_buffer_line(message.ts, new_text)
             if not did_update:
                 print_error(
                     f"Didn't find message with ts {message.ts} when last_printed_ts is {self.last_printed_ts}, message: {message}"
@@ -2164,7 +2503,18 @@ class SlackMessageBuffer(ABC):
         tags = await message.tags(self.context, backlog)
         if message.ts in self.hotlist_tss:
             tags += ",notify_none"
+        prev_last_line_pointer = self._own_lines_pointer("last_line")
         weechat.prnt_date_tags(self.buffer_pointer, message.ts.major, tags, rendered)
+        self._add_printed_lines(message.ts, prev_last_line_pointer)
+        if message.sender_user_id and message.subtype in [
+            None,
+            "me_message",
+            "thread_broadcast",
+        ]:
+            self.recent_senders[message.sender_user_id] = None
+            self.recent_senders.move_to_end(message.sender_user_id)
+            if len(self.recent_senders) > RECENT_SENDERS_MAX:
+                self.recent_senders.popitem(last=False)
         if backlog:
             weechat.buffer_set(self.buffer_pointer, "unread", "")
         else:
@@ -2221,8 +2571,8 @@ class SlackMessageBuffer(ABC):
                 index -= 1
             elif message_filter == "sender_self":
                 ts = hdata_line_ts(line)
-                if ts is not None:
-                    message = self.messages[ts]
+                message = self.messages.get(ts) if ts is not None else None
+                if message is not None:
                     if (
                         message.sender_user_id == self.workspace.my_user.id
                         and message.subtype in [None, "me_message", "thread_broadcast"]
@@ -2268,18 +2618,27 @@ class SlackMessageBuffer(ABC):
     async def send_change_reaction(
         self, ts: SlackTs, emoji_char: str, change_type: Literal["+", "-", "toggle"]
     ) -> None:
-        emoji = shared.standard_emojis_inverse.get(emoji_char)
-        emoji_name = emoji["name"] if emoji else emoji_char
+        emoji_name = shared.standard_emojis.name_for_unicode(emoji_char) or emoji_char
 
         if change_type == "toggle":
-            message = self.messages[ts]
-            has_reacted = message.has_reacted(emoji_name)
+            message = await self.get_message(ts)
+            has_reacted = message is not None and message.has_reacted(emoji_name)
             change_type = "-" if has_reacted else "+"
 
         await self.api.reactions_change(self.conversation, ts, emoji_name, change_type)
 
+    async def get_message(self, ts: SlackTs) -> Optional[SlackMessage]:
+        message = self.messages.get(ts)
+        if message is None and ts in self._line_pointers:
+            # The message has been removed from memory, so load it again
+            message = await self.conversation.fetch_message(ts)
+        return message
+
     async def edit_message(self, ts: SlackTs, old: str, new: str, flags: str):
-        message = self.messages[ts]
+        message = await self.get_message(ts)
+        if message is None:
+            print_error(f"Message with ts {ts} not found")
+            return
 
         if new == "" and old == "":
             await self.api.chat_delete_message(self.conversation, message.ts)
@@ -2306,18 +2665,14 @@ class SlackMessageBuffer(ABC):
             .replace("\x1d", "_")
         )
 
-        users = await gather(*self.workspace.users.values(), return_exceptions=True)
-        nick_to_user_id = {
-            user.nick.raw_nick: user.id
-            for user in users
-            if not isinstance(user, BaseException)
-        }
+        users = self.workspace.users
 
         def linkify_word(match: Match[str]) -> str:
             word = match.group(0)
             nick = match.group(1)
-            if nick in nick_to_user_id:
-                return f"<@{nick_to_user_id[nick]}>"
+            user_id = users.user_id_from_nick(nick)
+            if user_id is not None:
+                return f"<@{user_id}>"
             return word
 
         linkify_regex = r"(?:^|(?<=\s))@([\w\(\)\'.-]+)"
@@ -2390,6 +2745,7 @@ class SlackMessageBuffer(ABC):
         self.buffer_pointer = None
         self.last_printed_ts = None
         self.hotlist_tss.clear()
+        self.clear_line_pointers()
 
 
 if TYPE_CHECKING:
@@ -2528,6 +2884,14 @@ def display_workspace(workspace: SlackWorkspace, detailed_list: bool):
     else:
         weechat.prnt("", f"   {with_color('chat_server', workspace.name)}")
 
+    if detailed_list and workspace.ws_frames_received:
+        weechat.prnt(
+            "",
+            f"     websocket: {workspace.ws_frames_received} frame(s), "
+            f"{workspace.ws_bytes_received / 1024:.1f} KiB received, "
+            f"{workspace.ws_decode_time * 1000:.1f} ms spent decoding",
+        )
+
 
 @weechat_command()
 def command_slack(buffer: str, args: List[str], options: Options):
@@ -2900,7 +3264,41 @@ def print_uncaught_error(error: UncaughtError, detailed: bool, options: Options)
             print_error("This error does not have any data")
 
 
-@weechat_command("tasks|buffer|open_buffer|replay_events|errors|error", max_split=0)
+def print_memory_stats():
+    for workspace in shared.workspaces.values():
+        conversations = get_resolved_futures(workspace.conversations.values())
+        messages_count = sum(len(c.messages) for c in conversations)
+        removed_count = sum(c.removed_messages_count for c in conversations)
+        weechat.prnt(
+            "",
+            f"Workspace {workspace.name}: {len(conversations)} conversations, "
+            f"{len(get_resolved_futures(workspace.users.values()))} users, "
+            f"{messages_count} messages, {removed_count} messages removed",
+        )
+        conversations.sort(key=lambda c: len(c.messages), reverse=True)
+        for conversation in conversations[:10]:
+            if not conversation.messages:
+                break
+            weechat.prnt(
+                "",
+                f"  {conversation.name_with_prefix('full_name')}: "
+                f"{len(conversation.messages)} messages, "
+                f"{len(conversation.message_hashes)} hashes, "
+                f"{conversation.removed_messages_count} messages removed",
+            )
+
+
+def print_startup_timings():
+    total = sum(duration for _, duration in shared.startup_timings)
+    weechat.prnt("", f"Script startup took {total * 1000:.1f} ms:")
+    for phase, duration in shared.startup_timings:
+        weechat.prnt("", f"  {phase}: {duration * 1000:.1f} ms")
+
+
+@weechat_command(
+    "tasks|buffer|open_buffer|replay_events|errors|error|memory|http|startup",
+    max_split=0,
+)
 async def command_slack_debug(buffer: str, args: List[str], options: Options):
     # TODO: Add message info (message_json)
     if args[0] == "tasks":
@@ -2961,6 +3359,19 @@ async def command_slack_debug(buffer: str, args: List[str], options: Options):
             error = shared.uncaught_errors[-1]
             weechat.prnt("", "Last error:")
         print_uncaught_error(error, True, options)
+    elif args[0] == "memory":
+        print_memory_stats()
+    elif args[0] == "http":
+        semaphore = shared.http_request_semaphore
+        weechat.prnt(
+            "",
+            f"HTTP requests: {semaphore.active} running, {semaphore.queued} queued "
+            f"(max {semaphore.limit} concurrent), "
+            f"{len(shared.http_requests_in_flight)} shareable in flight, "
+            f"{shared.http_requests_coalesced_count} coalesced in total",
+        )
+    elif args[0] == "startup":
+        print_startup_timings()
 
 
 @weechat_command("-clear")
@@ -2999,9 +3410,9 @@ def _get_linkarchive_url(
     if conversation is not None:
         url += f"archives/{conversation.id}/"
         if message_ts is not None:
-            message = conversation.messages[message_ts]
-            url += f"p{message.ts.major}{message.ts.minor:0>6}"
-            if message.thread_ts is not None:
+            message = conversation.messages.get(message_ts)
+            url += f"p{message_ts.major}{message_ts.minor:0>6}"
+            if message is not None and message.thread_ts is not None:
                 url += f"?thread_ts={message.thread_ts}&cid={conversation.id}"
     return url
 
@@ -3277,9 +3688,18 @@ def completion_emojis_cb(
     base_word = weechat.completion_get_string(completion, "base_word")
     reaction = re.match(REACTION_PREFIX_REGEX_STRING + ":", base_word)
     prefix = reaction.group(0) if reaction else ":"
-
+    # Only add the emojis matching the word being completed, since WeeChat
+    # would filter out the rest anyway
+    name_prefix = base_word[len(prefix) :] if base_word.startswith(prefix) else ""
+    name_prefix = name_prefix.lower()
+
+    custom_emoji_names = (
+        name
+        for name in slack_buffer.workspace.custom_emojis
+        if name.lower().startswith(name_prefix)
+    )
     emoji_names = chain(
-        shared.standard_emojis.keys(), slack_buffer.workspace.custom_emojis.keys()
+        shared.standard_emojis.names_with_prefix(name_prefix), custom_emoji_names
     )
     for emoji_name in emoji_names:
         if "::skin-tone-" not in emoji_name:
@@ -3299,71 +3719,50 @@ def completion_nicks_cb(
     if slack_buffer is None:
         return weechat.WEECHAT_RC_OK
 
-    all_users = get_resolved_futures(slack_buffer.workspace.users.values())
-    all_nicks = [user.nick for user in all_users]
-    all_raw_nicks = sorted([nick.raw_nick for nick in all_nicks], key=str.casefold)
-    for nick in all_raw_nicks:
-        weechat.completion_list_add(
-            completion,
-            f"@{nick}",
-            1,
-            weechat.WEECHAT_LIST_POS_END,
-        )
-        weechat.completion_list_add(
-            completion,
-            nick,
-            1,
-            weechat.WEECHAT_LIST_POS_END,
-        )
+    # Only add the nicks matching the word being completed, since WeeChat
+    # would filter out the rest anyway
+    base_word = weechat.completion_get_string(completion, "base_word")
+    prefix = removeprefix(base_word, "@")
+    prefix_casefolded = prefix.casefold()
+    add_with_at = not base_word or base_word.startswith("@")
+    add_without_at = not base_word.startswith("@")
 
-    members = (
-        slack_buffer.members
-        if isinstance(slack_buffer, SlackMessageBuffer)
-        else all_nicks
-    )
+    def nick_matches(nick: str) -> bool:
+        return nick.casefold().startswith(prefix_casefolded)
 
-    buffer_nicks = sorted(
-        [nick.raw_nick for nick in members], key=str.casefold, reverse=True
-    )
-    for nick in buffer_nicks:
-        weechat.completion_list_add(
-            completion,
-            nick,
-            1,
-            weechat.WEECHAT_LIST_POS_BEGINNING,
-        )
-        weechat.completion_list_add(
-            completion,
-            f"@{nick}",
-            1,
-            weechat.WEECHAT_LIST_POS_BEGINNING,
+    def add_nick(nick: str, position: str, with_at_first: bool):
+        with_at = [f"@{nick}"] if add_with_at else []
+        without_at = [nick] if add_without_at else []
+        for word in with_at + without_at if with_at_first else without_at + with_at:
+            weechat.completion_list_add(completion, word, 1, position)
+
+    all_raw_nicks = slack_buffer.workspace.users.nicks_with_prefix(prefix)
+    for nick in all_raw_nicks:
+        add_nick(nick, weechat.WEECHAT_LIST_POS_END, True)
+
+    if isinstance(slack_buffer, SlackMessageBuffer):
+        buffer_nicks = sorted(
+            [nick.raw_nick for nick in slack_buffer.members],
+            key=str.casefold,
+            reverse=True,
         )
+    else:
+        buffer_nicks = list(reversed(all_raw_nicks))
+    for nick in buffer_nicks:
+        if nick_matches(nick):
+            add_nick(nick, weechat.WEECHAT_LIST_POS_BEGINNING, False)
 
     if isinstance(slack_buffer, SlackMessageBuffer):
-        senders = [
-            m.sender_user_id
-            for m in slack_buffer.messages.values()
-            if m.sender_user_id
-            and m.subtype in [None, "me_message", "thread_broadcast"]
-        ]
-        unique_senders = list(dict.fromkeys(senders))
         sender_users = get_resolved_futures(
-            [slack_buffer.workspace.users[sender] for sender in unique_senders]
+            [
+                slack_buffer.workspace.users[sender]
+                for sender in slack_buffer.recent_senders
+            ]
         )
-        nicks = [user.nick.raw_nick for user in sender_users]
-        for nick in nicks:
-            weechat.completion_list_add(
-                completion,
-                nick,
-                1,
-                weechat.WEECHAT_LIST_POS_BEGINNING,
-            )
-            weechat.completion_list_add(
-                completion,
-                f"@{nick}",
-                1,
-                weechat.WEECHAT_LIST_POS_BEGINNING,
-            )
+        for user in sender_users:
+            nick = user.nick.raw_nick
+            if nick_matches(nick):
+                add_nick(nick, weechat.WEECHAT_LIST_POS_BEGINNING, False)
 
     my_user_nick = slack_buffer.workspace.my_user.nick.raw_nick
     weechat.completion_list_add(
@@ -3688,6 +4087,7 @@ class SlackConfigSectionLook:
             "bot_user_suffix",
             "the suffix appended to nicks to indicate a bot",
             " :]",
+            callback_change=self.config_change_nicks_cb,
         )
 
         self.thread_broadcast_prefix = WeeChatOption(
@@ -3745,6 +4145,7 @@ class SlackConfigSectionLook:
             "external_user_suffix",
             "the suffix appended to nicks to indicate external users",
             "*",
+            callback_change=self.config_change_nicks_cb,
         )
 
         self.leave_channel_on_buffer_close = WeeChatOption(
@@ -3794,6 +4195,7 @@ class SlackConfigSectionLook:
             "replace_space_in_nicks_with",
             "",
             "",
+            callback_change=self.config_change_nicks_cb,
         )
 
         self.workspace_buffer: WeeChatOption[
@@ -3832,6 +4234,11 @@ class SlackConfigSectionLook:
             get_callback_name(self.config_change_nick_colors_cb),
             "",
         )
+        weechat.hook_config(
+            "weechat.color.chat_nick_self",
+            get_callback_name(self.config_change_nick_colors_cb),
+            "",
+        )
 
     def config_change_color_nicks_in_nicklist_cb(
         self, option: WeeChatOption[WeeChatOptionType], parent_changed: bool
@@ -3854,11 +4261,114 @@ class SlackConfigSectionLook:
                 ):
                     weechat.buffer_merge(workspace.buffer_pointer, buffer_to_merge_with)
 
+    def config_change_nicks_cb(
+        self, option: WeeChatOption[WeeChatOptionType], parent_changed: bool
+    ):
+        invalidate_nicks()
+
     def config_change_nick_colors_cb(self, data: str, option: str, value: str):
+        nick_color_cache.clear()
+        invalidate_nicks()
         invalidate_nicklists()
         return weechat.WEECHAT_RC_OK
 
 
+class SlackConfigSectionNetwork:
+    def __init__(self, weechat_config: WeeChatConfig):
+        self._section = WeeChatSection(weechat_config, "network")
+
+        self.max_concurrent_requests = WeeChatOption(
+            self._section,
+            "max_concurrent_requests",
+            "maximum number of HTTP requests to run at the same time for all workspaces, other requests are queued until one finishes",
+            20,
+            min_value=1,
+            max_value=1000,
+            callback_change=self.config_change_max_concurrent_requests_cb,
+        )
+
+        self.websocket_receive_buffer_size = WeeChatOption(
+            self._section,
+            "websocket_receive_buffer_size",
+            "size (in KiB) of the receive buffer of the websocket connections, a larger buffer lets bursts of events be read at once; 0 = use the system default (the system may limit the size); takes effect on the next connect",
+            1024,
+            min_value=0,
+            max_value=65536,
+        )
+
+        self.batch_websocket_events = WeeChatOption(
+            self._section,
+            "batch_websocket_events",
+            "handle all the websocket events which are available at once together, events for the same conversation are handled in order and edits of a message which are superseded by a later edit in the same batch are skipped",
+            True,
+        )
+
+    def config_change_max_concurrent_requests_cb(
+        self, option: WeeChatOption[WeeChatOptionType], parent_changed: bool
+    ):
+        shared.http_request_semaphore.set_limit(self.max_concurrent_requests.value)
+
+
+class SlackConfigSectionDebug:
+    def __init__(self, weechat_config: WeeChatConfig):
+        self._section = WeeChatSection(weechat_config, "debug")
+
+        self.level: WeeChatOption[
+            Literal["trace", "debug", "info", "warn", "error", "fatal"]
+        ] = WeeChatOption(
+            self._section,
+            "level",
+            "minimum level of debug messages to keep in memory for the debug buffer and to write to the log file; while the debug buffer is open, debug messages are kept as well",
+            "info",
+            string_values=["trace", "debug", "info", "warn", "error", "fatal"],
+        )
+
+        self.max_messages = WeeChatOption(
+            self._section,
+            "max_messages",
+            "maximum number of debug messages to keep in memory, the oldest messages are removed first",
+            5000,
+            min_value=0,
+            callback_change=self.config_change_max_messages_cb,
+        )
+
+        self.log_file = WeeChatOption(
+            self._section,
+            "log_file",
+            "also write the debug messages to slack_debug.log in the WeeChat data directory",
+            False,
+            callback_change=self.config_change_log_file_cb,
+        )
+
+        self.log_file_max_size = WeeChatOption(
+            self._section,
+            "log_file_max_size",
+            "size (in KiB) at which the log file is rotated",
+            10240,
+            min_value=1,
+            callback_change=self.config_change_log_file_cb,
+        )
+
+        self.log_file_backup_count = WeeChatOption(
+            self._section,
+            "log_file_backup_count",
+            "number of rotated log files to keep",
+            3,
+            min_value=0,
+            callback_change=self.config_change_log_file_cb,
+        )
+
+    def config_change_max_messages_cb(
+        self, option: WeeChatOption[WeeChatOptionType], parent_changed: bool
+    ):
+        set_debug_messages_max(self.max_messages.value)
+
+    def config_change_log_file_cb(
+        self, option: WeeChatOption[WeeChatOptionType], parent_changed: bool
+    ):
+        update_debug_log_file()
+
+
 class SlackConfigSectionWorkspace:
     def __init__(
         self,
@@ -3902,24 +4412,97 @@ class SlackConfigSectionWorkspace:
             " false, display names will be used if set, with a fallback"
             " to the real name if display name is not set",
             False,
+            callback_change=self._config_change_nicks_cb,
         )
 
-    def _evaluate_with_workspace_name(self, value: str) -> str:
-        return weechat.string_eval_expression(
-            value, {}, {"workspace": self._workspace_name or ""}, {}
+        self.history_max_messages = self._create_option(
+            "history_max_messages",
+            "maximum number of messages (including thread replies) to keep in"
+            " memory per conversation, the oldest messages are removed first"
+            " (0 = unlimited). Messages which have not been printed yet are"
+            " never removed. Removed messages which are still displayed are"
+            " not updated on edits or reactions",
+            5000,
+            min_value=0,
         )
 
-    def _create_option(
-        self,
-        name: str,
-        description: str,
-        default_value: WeeChatOptionType,
+        self.history_max_age = self._create_option(
+            "history_max_age",
+            "maximum age (in hours) of messages to keep in memory per"
+            " conversation (0 = unlimited)",
+            0,
+            min_value=0,
+        )
+
+        self.history_max_threads = self._create_option(
+            "history_max_threads",
+            "maximum number of threads to keep the replies in memory for per"
+            " conversation, the least recently used threads which are not open"
+            " in a buffer are removed first (0 = unlimited)",
+            100,
+            min_value=0,
+        )
+
+        self.cache_items = self._create_option(
+            "cache_items",
+            "cache users, bots, usergroups, conversations and custom emojis on"
+            " disk, so they are available right away when connecting. Cached"
+            " items are refreshed in the background after they are used",
+            True,
+        )
+
+        self.history_load_concurrency = self._create_option(
+            "history_load_concurrency",
+            "number of unread conversations to load the history for at the"
+            " same time after connecting",
+            3,
+            min_value=1,
+        )
+
+        self.history_load_rate_limit = self._create_option(
+            "history_load_rate_limit",
+            "maximum number of history requests per minute, which paces"
+            " loading the history for unread conversations after connecting."
+            " This applies to all history requests, including pages and"
+            " thread replies, and they pause when Slack responds with a"
+            " ratelimit",
+            40,
+            min_value=1,
+        )
+
+        self.thread_replies_concurrency = self._create_option(
+            "thread_replies_concurrency",
+            "number of threads to load the replies for at the same time when"
+            " loading the history of a conversation with thread replies"
+            " displayed in the channel",
+            5,
+            min_value=1,
+        )
+
+    def _config_change_nicks_cb(
+        self, option: WeeChatOption[WeeChatOptionType], parent_changed: bool
+    ):
+        invalidate_nicks()
+
+    def _evaluate_with_workspace_name(self, value: str) -> str:
+        return weechat.string_eval_expression(
+            value, {}, {"workspace": self._workspace_name or ""}, {}
+        )
+
+    def _create_option(
+        self,
+        name: str,
+        description: str,
+        default_value: WeeChatOptionType,
         min_value: Optional[int] = None,
         max_value: Optional[int] = None,
         string_values: Optional[list[WeeChatOptionType]] = None,
         evaluate_func: Optional[
             Callable[[WeeChatOptionType], WeeChatOptionType]
         ] = None,
+        callback_change: Optional[
+            Callable[[WeeChatOption[WeeChatOptionType], bool], None]
+        ] = None,
     ) -> WeeChatOption[WeeChatOptionType]:
         if self._workspace_name:
             option_name = f"{self._workspace_name}.{name}"
@@ -3940,6 +4523,7 @@ class SlackConfigSectionWorkspace:
             max_value,
             string_values,
             parent_option,
+            callback_change=callback_change,
             evaluate_func=evaluate_func,
         )
 
@@ -4002,6 +4586,8 @@ class SlackConfig:
         self.weechat_config = WeeChatConfig("slack")
         self.color = SlackConfigSectionColor(self.weechat_config)
         self.look = SlackConfigSectionLook(self.weechat_config)
+        self.network = SlackConfigSectionNetwork(self.weechat_config)
+        self.debug = SlackConfigSectionDebug(self.weechat_config)
         self._section_workspace_default = WeeChatSection(
             self.weechat_config, "workspace_default"
         )
@@ -4022,9 +4608,21 @@ class SlackConfig:
         self._workspace_default = SlackConfigSectionWorkspace(
             self._section_workspace_default, None, None
         )
+        # Evaluated options may contain secured data
+        weechat.hook_config(
+            "sec.data.*", get_callback_name(self.config_change_sec_data_cb), ""
+        )
 
     def config_read(self):
         weechat.config_read(self.weechat_config.pointer)
+        for option in self.weechat_config.options:
+            option.clear_cached_value()
+
+    def config_change_sec_data_cb(self, data: str, option: str, value: str):
+        for weechat_option in self.weechat_config.options:
+            if weechat_option.evaluate_func is not None:
+                weechat_option.clear_cached_value()
+        return weechat.WEECHAT_RC_OK
 
     def create_workspace_config(self, workspace_name: str):
         if workspace_name in shared.workspaces:
@@ -4160,12 +4758,6 @@ def store_and_format_exception(e: BaseException) -> str:
     return store_and_format_uncaught_error(uncaught_error)
 
 
-def available_file_descriptors():
-    num_current_file_descriptors = len(os.listdir("/proc/self/fd/"))
-    max_file_descriptors = min(resource.getrlimit(resource.RLIMIT_NOFILE))
-    return max_file_descriptors - num_current_file_descriptors
-
-
 async def hook_process_hashtable(
     command: str, options: Dict[str, str], timeout: int
 ) -> Tuple[str, int, str, str]:
@@ -4175,8 +4767,6 @@ async def hook_process_hashtable(
         DebugMessageType.LOG,
         f"hook_process_hashtable calling ({future.id}): command: {command}",
     )
-    while available_file_descriptors() < 10:
-        await sleep(100)
     weechat.hook_process_hashtable(
         command, options, timeout, get_callback_name(weechat_task_cb), future.id
     )
@@ -4259,7 +4849,11 @@ async def http_request_url(
 
 
 async def http_request(
-    url: str, options: Dict[str, str], timeout: int, max_retries: int = 5
+    url: str,
+    options: Dict[str, str],
+    timeout: int,
+    max_retries: int = 5,
+    ratelimited_cb: Optional[Callable[[int], None]] = None,
 ) -> str:
     log(
         LogLevel.DEBUG,
@@ -4267,12 +4861,15 @@ async def http_request(
         f"requesting: {url}, {options.get('postfields')}",
     )
     try:
-        if hasattr(weechat, "hook_url"):
-            http_status, headers, body = await http_request_url(url, options, timeout)
-        else:
-            http_status, headers, body = await http_request_process(
-                url, options, timeout
-            )
+        async with shared.http_request_semaphore:
+            if hasattr(weechat, "hook_url"):
+                http_status, headers, body = await http_request_url(
+                    url, options, timeout
+                )
+            else:
+                http_status, headers, body = await http_request_process(
+                    url, options, timeout
+                )
     except HttpError as e:
         if max_retries > 0:
             log(
@@ -4282,7 +4879,9 @@ async def http_request(
                 f"return_code: {e.return_code}, error: {e.error}, url: {url}",
             )
             await sleep(1000)
-            return await http_request(url, options, timeout, max_retries - 1)
+            return await http_request(
+                url, options, timeout, max_retries - 1, ratelimited_cb
+            )
         raise
 
     if http_status == 429:
@@ -4296,8 +4895,12 @@ async def http_request(
                     DebugMessageType.LOG,
                     f"HTTP ratelimit, retrying in {retry_after} seconds, url: {url}",
                 )
+                if ratelimited_cb is not None:
+                    ratelimited_cb(retry_after)
                 await sleep(retry_after * 1000)
-                return await http_request(url, options, timeout)
+                return await http_request(
+                    url, options, timeout, ratelimited_cb=ratelimited_cb
+                )
 
     if http_status >= 400:
         raise HttpError(url, options, None, http_status, body)
@@ -4305,6 +4908,32 @@ async def http_request(
     return body
 
 
+async def http_request_coalesced(
+    url: str,
+    options: Dict[str, str],
+    timeout: int,
+    ratelimited_cb: Optional[Callable[[int], None]] = None,
+) -> str:
+    # Identical requests that are in flight share the response body, so only
+    # use this for requests that don't change anything
+    key = (url, tuple(sorted(options.items())))
+    task = shared.http_requests_in_flight.get(key)
+    if task is None:
+        task = create_task(
+            http_request(url, options, timeout, ratelimited_cb=ratelimited_cb)
+        )
+        shared.http_requests_in_flight[key] = task
+        task.add_done_callback(lambda _: shared.http_requests_in_flight.pop(key, None))
+    else:
+        shared.http_requests_coalesced_count += 1
+        log(
+            LogLevel.DEBUG,
+            DebugMessageType.HTTP_REQUEST,
+            f"coalescing with in flight request: {url}, {options.get('postfields')}",
+        )
+    return await task
+
+
 class LogLevel(IntEnum):
     TRACE = 1
     DEBUG = 2
@@ -4329,7 +4958,10 @@ class DebugMessage:
     message: str
 
 
-debug_messages: List[DebugMessage] = []
+debug_messages: Deque[DebugMessage] = deque(maxlen=5000)
+debug_logger = logging.getLogger("slack.debug")
+debug_logger.propagate = False
+debug_log_file_handler: Optional[logging.Handler] = None
 printed_exceptions: Set[BaseException] = set()
 
 
@@ -4344,14 +4976,71 @@ def print_exception_once(e: BaseException):
         printed_exceptions.add(e)
 
 
-def log(level: LogLevel, message_type: DebugMessageType, message: str):
+def debug_capture_level() -> LogLevel:
+    level = LogLevel[shared.config.debug.level.value.upper()]
+    if shared.debug_buffer_pointer and level > LogLevel.DEBUG:
+        return LogLevel.DEBUG
+    return level
+
+
+# The message may be a function returning the message, so it is only formatted
+# if the message is going to be used
+def log(
+    level: LogLevel,
+    message_type: DebugMessageType,
+    message: Union[str, Callable[[], str]],
+):
+    capture_level = debug_capture_level()
+    if level < LogLevel.INFO and level < capture_level:
+        return
+
+    if callable(message):
+        message = message()
+
     if level >= LogLevel.INFO:
         prefix = weechat.prefix("error") if level >= LogLevel.ERROR else "\t"
         weechat.prnt("", f"{prefix}{shared.SCRIPT_NAME} {level.name}: {message}")
 
-    debug_message = DebugMessage(time.time(), level, message_type, message)
-    debug_messages.append(debug_message)
-    print_debug_buffer(debug_message)
+    if level >= capture_level:
+        debug_message = DebugMessage(time.time(), level, message_type, message)
+        debug_messages.append(debug_message)
+        print_debug_buffer(debug_message)
+        if debug_log_file_handler is not None:
+            debug_logger.info(
+                f"{debug_message.level.name} - {debug_message.message_type.name}"
+                f"\t{debug_message.message}"
+            )
+
+
+def set_debug_messages_max(max_messages: int):
+    global debug_messages
+    debug_messages = deque(debug_messages, maxlen=max_messages)
+
+
+def update_debug_log_file():
+    global debug_log_file_handler
+    if debug_log_file_handler is not None:
+        debug_logger.removeHandler(debug_log_file_handler)
+        debug_log_file_handler.close()
+        debug_log_file_handler = None
+
+    if shared.config.debug.log_file.value:
+        path = f"{get_weechat_data_dir()}/{shared.SCRIPT_NAME}_debug.log"
+        try:
+            debug_log_file_handler = logging.handlers.RotatingFileHandler(
+                path,
+                maxBytes=shared.config.debug.log_file_max_size.value * 1024,
+                backupCount=shared.config.debug.log_file_backup_count.value,
+                encoding="utf-8",
+            )
+        except OSError as e:
+            print_error(f"couldn't open debug log file: {format_exception_only_str(e)}")
+            return
+        debug_log_file_handler.setFormatter(
+            logging.Formatter("%(asctime)s %(message)s")
+        )
+        debug_logger.addHandler(debug_log_file_handler)
+        debug_logger.setLevel(logging.INFO)
 
 
 def _close_debug_buffer_cb(data: str, buffer: str):
@@ -4455,6 +5144,7 @@ SCRIPT_DESC = "Extends weechat for typing notification/search/etc on slack.com"
 def shutdown_cb():
     shared.script_is_unloading = True
     weechat.config_write(shared.config.weechat_config.pointer)
+    shared.cache.close()
     return weechat.WEECHAT_RC_OK
 
 
@@ -4474,6 +5164,13 @@ def signal_buffer_switch_cb(data: str, signal: str, buffer_pointer: str) -> int:
     return weechat.WEECHAT_RC_OK
 
 
+def signal_buffer_cleared_cb(data: str, signal: str, buffer_pointer: str) -> int:
+    slack_buffer = shared.buffers.get(buffer_pointer)
+    if isinstance(slack_buffer, SlackMessageBuffer):
+        slack_buffer.clear_line_pointers()
+    return weechat.WEECHAT_RC_OK
+
+
 def input_text_changed_cb(data: str, signal: str, buffer_pointer: str) -> int:
     reset_completion_context_on_input(buffer_pointer)
     return weechat.WEECHAT_RC_OK
@@ -4553,46 +5250,80 @@ async def init_async():
                 run_async(workspace.connect())
 
 
+@contextmanager
+def startup_phase(phase: str):
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        shared.startup_timings.append((phase, time.perf_counter() - start_time))
+
+
 def register():
-    if weechat.register(
-        shared.SCRIPT_NAME,
-        SCRIPT_AUTHOR,
-        shared.SCRIPT_VERSION,
-        SCRIPT_LICENSE,
-        SCRIPT_DESC,
-        get_callback_name(shutdown_cb),
-        "",
-    ):
+    shared.startup_timings = [
+        ("load script", time.perf_counter() - shared.script_load_start_time)
+    ]
+    with startup_phase("register script"):
+        registered = weechat.register(
+            shared.SCRIPT_NAME,
+            SCRIPT_AUTHOR,
+            shared.SCRIPT_VERSION,
+            SCRIPT_LICENSE,
+            SCRIPT_DESC,
+            get_callback_name(shutdown_cb),
+            "",
+        )
+    if registered:
         shared.weechat_version = int(weechat.info_get("version_number", "") or 0)
         shared.current_buffer_pointer = weechat.current_buffer()
-        shared.standard_emojis = load_standard_emojis()
-        shared.standard_emojis_inverse = {
-            value["unicode"]: value for value in shared.standard_emojis.values()
-        }
+        # The standard emojis and the cache are loaded on first use
+        shared.standard_emojis = EmojiStore()
         shared.workspaces = {}
-        shared.config = SlackConfig()
-        shared.config.config_read()
-        register_completions()
-        register_commands()
+        shared.http_request_semaphore = Semaphore(0)
+        shared.cache = SlackCache(f"{get_weechat_data_dir()}/slack_cache.sqlite")
+        with startup_phase("read config"):
+            shared.config = SlackConfig()
+            shared.config.config_read()
+        shared.http_request_semaphore.set_limit(
+            shared.config.network.max_concurrent_requests.value
+        )
+        with startup_phase("set up debug log"):
+            set_debug_messages_max(shared.config.debug.max_messages.value)
+            update_debug_log_file()
+        with startup_phase("register completions"):
+            register_completions()
+        with startup_phase("register commands"):
+            register_commands()
+        with startup_phase("hook signals"):
+            register_hooks()
 
-        weechat.hook_signal(
-            "buffer_switch", get_callback_name(signal_buffer_switch_cb), ""
-        )
-        weechat.hook_signal(
-            "input_text_changed", get_callback_name(input_text_changed_cb), ""
-        )
-        weechat.hook_signal(
-            "input_text_cursor_moved", get_callback_name(input_text_cursor_moved_cb), ""
-        )
-        weechat.hook_modifier(
-            "100|input_text_display_with_cursor",
-            get_callback_name(modifier_input_text_display_with_cursor_cb),
-            "",
+        run_async(init_async())
+        total = sum(duration for _, duration in shared.startup_timings)
+        log(
+            LogLevel.DEBUG,
+            DebugMessageType.LOG,
+            f"script startup took {total * 1000:.1f} ms",
         )
-        weechat.hook_signal("typing_self_*", get_callback_name(typing_self_cb), "")
-        weechat.hook_timer(5000, 0, 0, get_callback_name(ws_ping_cb), "")
 
-        run_async(init_async())
+
+def register_hooks():
+    weechat.hook_signal("buffer_switch", get_callback_name(signal_buffer_switch_cb), "")
+    weechat.hook_signal(
+        "buffer_cleared", get_callback_name(signal_buffer_cleared_cb), ""
+    )
+    weechat.hook_signal(
+        "input_text_changed", get_callback_name(input_text_changed_cb), ""
+    )
+    weechat.hook_signal(
+        "input_text_cursor_moved", get_callback_name(input_text_cursor_moved_cb), ""
+    )
+    weechat.hook_modifier(
+        "100|input_text_display_with_cursor",
+        get_callback_name(modifier_input_text_display_with_cursor_cb),
+        "",
+    )
+    weechat.hook_signal("typing_self_*", get_callback_name(typing_self_cb), "")
+    weechat.hook_timer(5000, 0, 0, get_callback_name(ws_ping_cb), "")
 
 
 if TYPE_CHECKING:
@@ -4653,7 +5384,7 @@ class SlackEdgeApi(SlackApiCommon):
         options = self._get_request_options()
         options["postfields"] = json.dumps(params)
         options["httpheader"] += "\nContent-Type: application/json"
-        response = await http_request(
+        response = await http_request_coalesced(
             url,
             options,
             self.workspace.config.network_timeout.value * 1000,
@@ -4704,6 +5435,29 @@ class SlackEdgeApi(SlackApiCommon):
         return response
 
 
+# Methods which only read data, so identical concurrent calls can share a request
+COALESCED_API_METHODS = {
+    "bots.info",
+    "client.counts",
+    "client.userBoot",
+    "conversations.history",
+    "conversations.info",
+    "conversations.list",
+    "conversations.members",
+    "conversations.replies",
+    "emoji.list",
+    "files.info",
+    "team.info",
+    "usergroups.list",
+    "users.conversations",
+    "users.info",
+    "users.prefs.get",
+}
+
+# Methods which count towards the budget of SlackWorkspace.history_rate_limiter
+HISTORY_API_METHODS = {"conversations.history", "conversations.replies"}
+
+
 class SlackApi(SlackApiCommon):
     def __init__(self, workspace: SlackWorkspace):
         super().__init__(workspace)
@@ -4713,13 +5467,54 @@ class SlackApi(SlackApiCommon):
         url = f"https://api.slack.com/api/{method}"
         options = self._get_request_options()
         options["postfields"] = urlencode(params)
-        response = await http_request(
+        request = (
+            http_request_coalesced if method in COALESCED_API_METHODS else http_request
+        )
+        ratelimited_cb = None
+        if method in HISTORY_API_METHODS:
+            # Each page and each thread is a separate request, so every
+            # request has to wait for a token
+            await self.workspace.history_rate_limiter.acquire()
+            # Other methods are in other rate limit tiers, so a ratelimit for
+            # them shouldn't pause loading history
+            ratelimited_cb = self.workspace.history_rate_limiter.penalize
+        response = await request(
             url,
             options,
             self.workspace.config.network_timeout.value * 1000,
+            ratelimited_cb=ratelimited_cb,
         )
         return json.loads(response)
 
+    async def _fetch_pages(
+        self,
+        method: str,
+        params: Params = {},
+        limit: Optional[int] = None,
+    ) -> AsyncGenerator[Any, None]:
+        # Yields the response for each page until limit items have been
+        # requested, there are no more pages or a response is not ok
+        remaining = limit
+        cursor = None
+        while True:
+            cur_limit = 1000 if remaining is None or remaining > 1000 else remaining
+            page_params: Params = {**params, "limit": cur_limit}
+            if cursor:
+                page_params = {**page_params, "cursor": cursor}
+            response = await self._fetch(method, page_params)
+            yield response
+
+            if remaining is not None:
+                remaining -= cur_limit
+            cursor = response.get("response_metadata", {}).get("next_cursor")
+            if (
+                not response["ok"]
+                or not cursor
+                or remaining is not None
+                and remaining <= 0
+            ):
+                return
+
     async def _fetch_list(
         self,
         method: str,
@@ -4727,15 +5522,14 @@ class SlackApi(SlackApiCommon):
         params: Params = {},
         limit: Optional[int] = None,
     ):
-        cur_limit = 1000 if limit is None or limit > 1000 else limit
-        response = await self._fetch(method, {**params, "limit": cur_limit})
-        remaining = limit - cur_limit if limit is not None else None
-        next_cursor = response.get("response_metadata", {}).get("next_cursor")
-        if (remaining is None or remaining > 0) and next_cursor and response["ok"]:
-            new_params = {**params, "cursor": next_cursor}
-            next_pages = await self._fetch_list(method, list_key, new_params, remaining)
-            response[list_key].extend(next_pages[list_key])
-            return response
+        response = None
+        async for page in self._fetch_pages(method, params, limit):
+            if response is None:
+                response = page
+            elif page["ok"]:
+                response[list_key].extend(page[list_key])
+            else:
+                return page
         return response
 
     async def _post(self, method: str, body: Mapping[str, object]):
@@ -4781,7 +5575,10 @@ class SlackApi(SlackApiCommon):
         return response
 
     async def fetch_conversations_history_after(
-        self, conversation: SlackConversation, after: SlackTs
+        self,
+        conversation: SlackConversation,
+        after: SlackTs,
+        limit: Optional[int] = None,
     ):
         method = "conversations.history"
         params: Params = {
@@ -4790,20 +5587,25 @@ class SlackApi(SlackApiCommon):
             "inclusive": False,
         }
         response: SlackConversationsHistoryResponse = await self._fetch_list(
-            method, "messages", params
+            method, "messages", params, limit
         )
         if response["ok"] is False:
             raise SlackApiError(self.workspace, method, response, params)
         return response
 
     async def fetch_conversations_replies(
-        self, conversation: SlackConversation, parent_message_ts: SlackTs
+        self,
+        conversation: SlackConversation,
+        parent_message_ts: SlackTs,
+        oldest: Optional[SlackTs] = None,
     ):
         method = "conversations.replies"
         params: Params = {
             "channel": conversation.id,
             "ts": parent_message_ts,
         }
+        if oldest is not None:
+            params = {**params, "oldest": oldest, "inclusive": False}
         response: SlackConversationsRepliesResponse = await self._fetch_list(
             method, "messages", params
         )
@@ -4811,6 +5613,37 @@ class SlackApi(SlackApiCommon):
             raise SlackApiError(self.workspace, method, response, params)
         return response
 
+    async def fetch_conversations_history_message(
+        self, conversation: SlackConversation, ts: SlackTs
+    ):
+        method = "conversations.history"
+        params: Params = {
+            "channel": conversation.id,
+            "latest": ts,
+            "inclusive": True,
+            "limit": 1,
+        }
+        response: SlackConversationsHistoryResponse = await self._fetch(method, params)
+        if response["ok"] is False:
+            raise SlackApiError(self.workspace, method, response, params)
+        return response
+
+    async def fetch_conversations_replies_message(
+        self, conversation: SlackConversation, ts: SlackTs
+    ):
+        method = "conversations.replies"
+        params: Params = {
+            "channel": conversation.id,
+            "ts": ts,
+            "latest": ts,
+            "oldest": ts,
+            "inclusive": True,
+        }
+        response: SlackConversationsRepliesResponse = await self._fetch(method, params)
+        if response["ok"] is False:
+            raise SlackApiError(self.workspace, method, response, params)
+        return response
+
     async def fetch_conversations_info(self, conversation_id: str):
         method = "conversations.info"
         params: Params = {"channel": conversation_id}
@@ -4844,7 +5677,7 @@ class SlackApi(SlackApiCommon):
             "types": "public_channel",
         }
         response: SlackConversationsListPublicResponse = await self._fetch_list(
-            method, "chanels", params, limit
+            method, "channels", params, limit
         )
         if response["ok"] is False:
             raise SlackApiError(self.workspace, method, response, params)
@@ -4932,7 +5765,7 @@ class SlackApi(SlackApiCommon):
             raise SlackApiError(self.workspace, method, response, params)
         return response
 
-    async def fetch_bots_info(self, bot_ids: Iterable[str]):
+    async def _fetch_bots_info_without_splitting(self, bot_ids: Iterable[str]):
         method = "bots.info"
         params: Params = {"bots": ",".join(bot_ids)}
         response: SlackBotsInfoResponse = await self._fetch(method, params)
@@ -4940,6 +5773,19 @@ class SlackApi(SlackApiCommon):
             raise SlackApiError(self.workspace, method, response, params)
         return response
 
+    async def fetch_bots_info(self, bot_ids: Iterable[str]):
+        responses = await gather(
+            *(
+                self._fetch_bots_info_without_splitting(bot_ids_batch)
+                for bot_ids_batch in chunked(
+                    bot_ids, self.workspace.max_bots_per_fetch_request
+                )
+            )
+        )
+        bots = list(chain(*(response["bots"] for response in responses)))
+        response: SlackBotsInfoResponse = {"ok": True, "bots": bots}
+        return response
+
     async def fetch_usergroups_list(self, include_users: bool):
         method = "usergroups.list"
         params: Params = {"include_users": include_users}
@@ -5166,6 +6012,12 @@ def invalidate_nicklists():
             conversation.nicklist_needs_refresh = True
 
 
+def invalidate_nicks():
+    shared.nick_generation += 1
+    for workspace in shared.workspaces.values():
+        workspace.users.invalidate_nick_index()
+
+
 async def create_conversation_for_users(
     workspace: SlackWorkspace, user_ids: Iterable[str]
 ):
@@ -5191,6 +6043,11 @@ class SlackConversationMessageHashes(Dict[SlackTs, str]):
         super().__init__()
         self._conversation = conversation
         self._inverse_map: Dict[str, SlackTs] = {}
+        # The full hashes of all the keys in sorted order. Since the short
+        # hashes are prefixes of the full hashes, the only short hashes which
+        # can collide with a new hash are the ones of its neighbours here.
+        self._sorted_full_hashes: List[str] = []
+        self._full_hash_to_ts: Dict[str, SlackTs] = {}
 
     def __setitem__(self, key: SlackTs, value: str) -> NoReturn:
         raise RuntimeError("Set from outside isn't allowed")
@@ -5199,6 +6056,11 @@ class SlackConversationMessageHashes(Dict[SlackTs, str]):
         if key in self:
             hash_key = self[key]
             del self._inverse_map[hash_key]
+            full_hash = hash_from_ts(key)
+            index = bisect_left(self._sorted_full_hashes, full_hash)
+            if self._sorted_full_hashes[index : index + 1] == [full_hash]:
+                del self._sorted_full_hashes[index]
+            self._full_hash_to_ts.pop(full_hash, None)
         super().__delitem__(key)
 
     def _setitem(self, key: SlackTs, value: str) -> None:
@@ -5207,35 +6069,33 @@ class SlackConversationMessageHashes(Dict[SlackTs, str]):
     def __missing__(self, key: SlackTs) -> str:
         hash_len = 3
         full_hash = hash_from_ts(key)
-        short_hash = full_hash[:hash_len]
-
-        while any(
-            existing_hash.startswith(short_hash) for existing_hash in self._inverse_map
-        ):
-            hash_len += 1
-            short_hash = full_hash[:hash_len]
-
-        if short_hash[:-1] in self._inverse_map:
-            ts_with_same_hash = self._inverse_map.pop(short_hash[:-1])
-            other_full_hash = hash_from_ts(ts_with_same_hash)
-            other_short_hash = other_full_hash[:hash_len]
-
-            while short_hash == other_short_hash:
-                hash_len += 1
-                short_hash = full_hash[:hash_len]
-                other_short_hash = other_full_hash[:hash_len]
-
-            self._setitem(ts_with_same_hash, other_short_hash)
-            self._inverse_map[other_short_hash] = ts_with_same_hash
-
-            other_message = self._conversation.messages.get(ts_with_same_hash)
-            if other_message:
-                run_async(self._conversation.rerender_message(other_message))
-                if other_message.thread_buffer is not None:
-                    other_message.thread_buffer.update_buffer_props()
-                for reply in other_message.replies.values():
-                    run_async(self._conversation.rerender_message(reply))
+        index = bisect_left(self._sorted_full_hashes, full_hash)
+        neighbour_full_hashes = self._sorted_full_hashes[max(index - 1, 0) : index + 1]
+
+        for other_full_hash in neighbour_full_hashes:
+            common_prefix_len = len(os.path.commonprefix([full_hash, other_full_hash]))
+            hash_len = max(hash_len, common_prefix_len + 1)
+
+            ts_with_same_hash = self._full_hash_to_ts[other_full_hash]
+            other_short_hash = self[ts_with_same_hash]
+            if len(other_short_hash) <= common_prefix_len:
+                # The other hash is a prefix of this hash, so make it longer
+                other_short_hash = other_full_hash[: common_prefix_len + 1]
+                del self._inverse_map[self[ts_with_same_hash]]
+                self._setitem(ts_with_same_hash, other_short_hash)
+                self._inverse_map[other_short_hash] = ts_with_same_hash
+
+                other_message = self._conversation.messages.get(ts_with_same_hash)
+                if other_message:
+                    self._conversation.schedule_rerender(other_message)
+                    if other_message.thread_buffer is not None:
+                        other_message.thread_buffer.update_buffer_props()
+                    for reply in other_message.replies.values():
+                        self._conversation.schedule_rerender(reply)
 
+        short_hash = full_hash[:hash_len]
+        self._sorted_full_hashes.insert(index, full_hash)
+        self._full_hash_to_ts[full_hash] = key
         self._setitem(key, short_hash)
         self._inverse_map[short_hash] = key
         return self[key]
@@ -5267,7 +6127,12 @@ class SlackConversation(SlackMessageBuffer):
         self._members: Optional[List[str]] = None
         self._im_user: Optional[SlackUser] = None
         self._mpim_users: Optional[List[SlackUser]] = None
-        self._messages: OrderedDict[SlackTs, SlackMessage] = OrderedDict()
+        self._messages = SlackMessageStore()
+        # Threads which have their replies loaded, least recently used first
+        self._threads_lru: OrderedDict[SlackTs, None] = OrderedDict()
+        self._last_remove_old_messages_time = 0.0
+        self.removed_messages_count = 0
+        self._messages_to_rerender: Dict[SlackTs, SlackMessage] = {}
         self._nicklist: Dict[Nick, str] = {}
         self.nicklist_needs_refresh = True
         self.message_hashes = SlackConversationMessageHashes(self)
@@ -5378,12 +6243,128 @@ class SlackConversation(SlackMessageBuffer):
         if self.type == "im":
             return self._info.get("user")
 
+    def update_info_json(self, info_json: SlackConversationsInfoInternal):
+        previous_name = self._info.get("name")
+        self._info.update(info_json)  # pyright: ignore [reportArgumentType, reportCallIssue]
+        if self._info.get("name") != previous_name:
+            self.workspace.rerender_dependents("conversation", self.id)
+        if "last_read" in info_json:
+            last_read = SlackTs(info_json["last_read"])
+            if last_read != self._last_read:
+                self.last_read = last_read
+        if "topic" in info_json:
+            self._topic = info_json["topic"]
+        self.update_buffer_props()
+
     def _add_or_update_message(self, message: SlackMessage):
         if message.ts in self._messages:
             self._messages[message.ts].update_message_json(message.message_json)
         else:
             self._messages[message.ts] = message
 
+    def mark_thread_used(self, thread_ts: SlackTs):
+        self._threads_lru[thread_ts] = None
+        self._threads_lru.move_to_end(thread_ts)
+
+    def _is_thread_open(self, message: SlackMessage) -> bool:
+        return (
+            message.thread_buffer is not None
+            and message.thread_buffer.buffer_pointer is not None
+        )
+
+    def _is_printed(self, ts: SlackTs) -> bool:
+        # Messages which are fetched, but not printed yet, can't be removed,
+        # since they are printed from memory
+        return self.buffer_pointer is None or (
+            self.last_printed_ts is not None and ts <= self.last_printed_ts
+        )
+
+    def _can_remove_thread_replies(self, parent_message: SlackMessage) -> bool:
+        if self._is_thread_open(parent_message):
+            return False
+        return (
+            not self.display_thread_replies()
+            or not parent_message.replies_tss
+            or self._is_printed(parent_message.replies_tss[-1])
+        )
+
+    def _remove_message(self, ts: SlackTs) -> int:
+        if self._messages.pop(ts, None) is None:
+            return 0
+        if ts in self.message_hashes:
+            del self.message_hashes[ts]
+        return 1
+
+    def _remove_thread_replies(self, parent_message: SlackMessage) -> int:
+        removed_count = sum(
+            self._remove_message(ts) for ts in parent_message.replies_tss
+        )
+        parent_message.replies_tss = []
+        parent_message.reply_history_filled = False
+        self._threads_lru.pop(parent_message.ts, None)
+        return removed_count
+
+    def remove_old_messages(self, force: bool = False):
+        max_messages = self.workspace.config.history_max_messages.value
+        max_age = self.workspace.config.history_max_age.value
+        max_threads = self.workspace.config.history_max_threads.value
+        now = time.time()
+
+        if not force:
+            # Allow the limit to be exceeded by a margin, so we don't have to
+            # look through the messages every time a new message is added
+            max_messages_exceeded = max_messages and len(self._messages) > (
+                max_messages + max(max_messages // 10, 10)
+            )
+            max_threads_exceeded = max_threads and len(self._threads_lru) > max_threads
+            max_age_check_due = (
+                max_age and now - self._last_remove_old_messages_time > 60
+            )
+            if not (max_messages_exceeded or max_threads_exceeded or max_age_check_due):
+                return
+
+        self._last_remove_old_messages_time = now
+        removed_count = 0
+
+        if max_threads:
+            for thread_ts in list(self._threads_lru):
+                if len(self._threads_lru) <= max_threads:
+                    break
+                parent_message = self._messages.get(thread_ts)
+                if parent_message is None:
+                    del self._threads_lru[thread_ts]
+                elif self._can_remove_thread_replies(parent_message):
+                    removed_count += self._remove_thread_replies(parent_message)
+
+        oldest_ts_to_keep = (
+            SlackTs(f"{int(now - max_age * 3600)}.000000") if max_age else None
+        )
+        if max_messages or oldest_ts_to_keep is not None:
+            # Replies are removed together with their parent message
+            top_level_tss = [
+                ts
+                for ts, message in self._messages.items()
+                if message.parent_message is None
+            ]
+            for ts in top_level_tss:
+                too_many = max_messages and len(self._messages) > max_messages
+                too_old = oldest_ts_to_keep is not None and ts < oldest_ts_to_keep
+                if not too_many and not too_old or not self._is_printed(ts):
+                    break
+                message = self._messages[ts]
+                if not self._can_remove_thread_replies(message):
+                    continue
+                removed_count += self._remove_thread_replies(message)
+                removed_count += self._remove_message(ts)
+
+        if removed_count:
+            self.removed_messages_count += removed_count
+            log(
+                LogLevel.DEBUG,
+                DebugMessageType.LOG,
+                f"removed {removed_count} old messages from {self}",
+            )
+
     def sort_key(self) -> str:
         type_sort_key = {
             "channel": 0,
@@ -5500,6 +6481,20 @@ class SlackConversation(SlackMessageBuffer):
         if parent_message and parent_message.thread_buffer:
             await parent_message.thread_buffer.rerender_message(message)
 
+    def schedule_rerender(self, message: SlackMessage):
+        self._messages_to_rerender[message.ts] = message
+        if len(self._messages_to_rerender) == 1:
+            run_async(self._rerender_scheduled_messages())
+
+    async def _rerender_scheduled_messages(self):
+        # Wait for the current callback to finish, so all the messages
+        # scheduled during it are rerendered together
+        await sleep(0)
+        messages = self._messages_to_rerender
+        self._messages_to_rerender = {}
+        for message in messages.values():
+            await self.rerender_message(message)
+
     async def load_members(self, load_all: bool = False):
         if self._members is None:
             members_response = await self.api.fetch_conversations_members(
@@ -5509,33 +6504,109 @@ class SlackConversation(SlackMessageBuffer):
         self.workspace.users.initialize_items(self._members)
         return self._members
 
-    async def fetch_replies(self, thread_ts: SlackTs) -> List[SlackMessage]:
-        replies_response = await self.api.fetch_conversations_replies(self, thread_ts)
+    async def fetch_message(self, ts: SlackTs) -> Optional[SlackMessage]:
+        # conversations.history only returns top level messages, so look for
+        # replies with conversations.replies, which accepts the ts of a reply
+        history = await self.api.fetch_conversations_history_message(self, ts)
+        messages_json = [m for m in history["messages"] if SlackTs(m["ts"]) == ts]
+        if not messages_json:
+            replies = await self.api.fetch_conversations_replies_message(self, ts)
+            messages_json = [m for m in replies["messages"] if SlackTs(m["ts"]) == ts]
+        if not messages_json:
+            return None
+
+        self._add_or_update_message(SlackMessage(self, messages_json[0]))
+        message = self._messages[ts]
+        parent_message = message.parent_message
+        if parent_message is not None and ts not in parent_message.replies_tss:
+            insort(parent_message.replies_tss, ts)
+        return message
+
+    async def fetch_replies(
+        self, thread_ts: SlackTs, oldest: Optional[SlackTs] = None
+    ) -> List[SlackMessage]:
+        # With oldest, only the replies after it are fetched and added to the
+        # replies which are already loaded
+        replies_response = await self.api.fetch_conversations_replies(
+            self, thread_ts, oldest
+        )
         messages = [
             SlackMessage(self, message) for message in replies_response["messages"]
         ]
 
-        if thread_ts != messages[0].ts:
+        if messages and thread_ts == messages[0].ts:
+            self._add_or_update_message(messages[0])
+            replies = messages[1:]
+        elif oldest is not None and thread_ts in self._messages:
+            replies = messages
+        else:
             raise SlackError(
                 self.workspace,
                 f"First message in conversations.replies response did not match thread_ts {thread_ts}",
                 replies_response,
             )
 
-        self._add_or_update_message(messages[0])
         parent_message = self._messages[thread_ts]
-
-        replies = messages[1:]
-        parent_message.replies_tss = [message.ts for message in replies]
+        if oldest is None:
+            parent_message.replies_tss = [message.ts for message in replies]
+        else:
+            replies = [reply for reply in replies if reply.ts > oldest]
+            parent_message.replies_tss = sorted(
+                set(parent_message.replies_tss).union(reply.ts for reply in replies)
+            )
         for reply in replies:
             self._add_or_update_message(reply)
 
-        self._messages = OrderedDict(sorted(self._messages.items()))
-
         parent_message.reply_history_filled = True
+        parent_message.replies_fetched_state = (
+            parent_message.latest_reply,
+            parent_message.reply_count,
+        )
+        self.mark_thread_used(thread_ts)
+        self.remove_old_messages()
         return replies
 
+    async def sync_thread_replies(self, thread_tss: Iterable[SlackTs]):
+        # Only fetch the threads which got replies since they were last
+        # fetched, and only fetch the new replies when nothing else changed
+        thread_fetches: List[Tuple[SlackTs, Optional[SlackTs]]] = []
+        for thread_ts in thread_tss:
+            parent_message = self._messages[thread_ts]
+            fetched_state = parent_message.replies_fetched_state
+            state = (parent_message.latest_reply, parent_message.reply_count)
+            if not parent_message.reply_history_filled or fetched_state is None:
+                thread_fetches.append((thread_ts, None))
+            elif state == fetched_state:
+                continue
+            elif (
+                parent_message.replies_tss
+                and fetched_state[0] is not None
+                and state[0] is not None
+                and state[0] > fetched_state[0]
+                and state[1] > fetched_state[1]
+            ):
+                thread_fetches.append((thread_ts, parent_message.replies_tss[-1]))
+            else:
+                thread_fetches.append((thread_ts, None))
+
+        semaphore = self.workspace.thread_replies_semaphore
+        semaphore.set_limit(self.workspace.config.thread_replies_concurrency.value)
+
+        async def fetch_thread(thread_ts: SlackTs, oldest: Optional[SlackTs]):
+            async with semaphore:
+                await self.fetch_replies(thread_ts, oldest)
+
+        await gather(*(fetch_thread(ts, oldest) for ts, oldest in thread_fetches))
+
+    async def _wait_for_read_state(self):
+        # The read state isn't cached, so when the conversation is created from
+        # the cache, it's only known after the conversation is revalidated
+        if self._last_read == SlackTs("0.0"):
+            await self.workspace.conversations.wait_until_revalidated(self.id)
+
     async def set_hotlist(self):
+        await self._wait_for_read_state()
+
         if self.last_printed_ts is not None:
             self.history_needs_refresh = True
 
@@ -5582,6 +6653,8 @@ class SlackConversation(SlackMessageBuffer):
                     self.hotlist_tss.add(message.latest_reply)
 
     async def fill_history(self, update: bool = False):
+        await self._wait_for_read_state()
+
         if self.is_loading:
             return
 
@@ -5593,11 +6666,13 @@ class SlackConversation(SlackMessageBuffer):
             return
 
         with self.loading():
-            history_after_ts = (
-                next(iter(self._messages), None)
-                if self.history_needs_refresh
-                else self.last_printed_ts
-            )
+            if self.history_needs_refresh:
+                # Messages which have been removed from memory are not
+                # fetched again, since they would just be removed again
+                history_after_ts = next(iter(self._messages), self.last_printed_ts)
+            else:
+                history_after_ts = self.last_printed_ts
+
             if history_after_ts:
                 history = await self.api.fetch_conversations_history_after(
                     self, history_after_ts
@@ -5612,24 +6687,20 @@ class SlackConversation(SlackMessageBuffer):
                 self._add_or_update_message(message)
 
             if self.display_thread_replies():
-                await gather(
-                    *(
-                        self.fetch_replies(message.ts)
-                        for message in conversation_messages
-                        if message.is_thread_parent
-                    )
+                await self.sync_thread_replies(
+                    message.ts
+                    for message in conversation_messages
+                    if message.is_thread_parent
                 )
 
             if self.history_needs_refresh:
                 await self.rerender_history()
 
-            self._messages = OrderedDict(sorted(self._messages.items()))
             self.history_pending_messages.clear()
             messages = [
                 message
-                for message in self._messages.values()
+                for message in self._messages.values_after(self.last_printed_ts)
                 if self.should_display_message(message)
-                and (self.last_printed_ts is None or message.ts > self.last_printed_ts)
             ]
 
             user_ids = [m.sender_user_id for m in messages if m.sender_user_id]
@@ -5672,6 +6743,7 @@ class SlackConversation(SlackMessageBuffer):
                 await self.print_message(message)
 
             self.history_needs_refresh = False
+            self.remove_old_messages()
 
     async def nicklist_update(self):
         if self.nicklist_needs_refresh and self.type != "im":
@@ -5735,13 +6807,13 @@ class SlackConversation(SlackMessageBuffer):
         )
 
     async def add_new_message(self, message: SlackMessage):
-        # TODO: Remove old messages
         self._add_or_update_message(message)
 
         parent_message = message.parent_message
         if parent_message:
             if message.ts not in parent_message.replies_tss:
                 parent_message.replies_tss.append(message.ts)
+            self.mark_thread_used(parent_message.ts)
             thread_buffer = parent_message.thread_buffer
             if thread_buffer:
                 if thread_buffer.is_loading:
@@ -5779,6 +6851,8 @@ class SlackConversation(SlackMessageBuffer):
                     f"{self.buffer_pointer};off;{user.nick.format()}",
                 )
 
+        self.remove_old_messages()
+
     async def change_message(
         self, data: Union[SlackMessageChanged, SlackMessageReplied]
     ):
@@ -5786,7 +6860,7 @@ class SlackConversation(SlackMessageBuffer):
         message = self._messages.get(ts)
         if message:
             message.update_message_json(data["message"])
-            await self.rerender_message(message)
+            self.schedule_rerender(message)
 
     async def delete_message(self, data: SlackMessageDeleted):
         ts = SlackTs(data["deleted_ts"])
@@ -5795,7 +6869,7 @@ class SlackConversation(SlackMessageBuffer):
         message = self._messages.get(ts)
         if message:
             message.deleted = True
-            await self.rerender_message(message)
+            self.schedule_rerender(message)
 
     async def update_message_room(
         self, data: Union[SlackShRoomJoin, SlackShRoomUpdate]
@@ -5804,19 +6878,19 @@ class SlackConversation(SlackMessageBuffer):
         message = self._messages.get(ts)
         if message:
             message.update_message_json_room(data["room"])
-            await self.rerender_message(message)
+            self.schedule_rerender(message)
 
     async def reaction_add(self, message_ts: SlackTs, reaction: str, user_id: str):
         message = self._messages.get(message_ts)
         if message:
             message.reaction_add(reaction, user_id)
-            await self.rerender_message(message)
+            self.schedule_rerender(message)
 
     async def reaction_remove(self, message_ts: SlackTs, reaction: str, user_id: str):
         message = self._messages.get(message_ts)
         if message:
             message.reaction_remove(reaction, user_id)
-            await self.rerender_message(message)
+            self.schedule_rerender(message)
 
     async def typing_add_user(self, data: SlackUserTyping):
         if not shared.config.look.typing_status_nicks:
@@ -5915,41 +6989,139 @@ if TYPE_CHECKING:
         unicode: str
 
 
-def load_standard_emojis() -> Dict[str, Emoji]:
-    weechat_dir = weechat.info_get("weechat_data_dir", "") or weechat.info_get(
+def get_weechat_data_dir() -> str:
+    return weechat.info_get("weechat_data_dir", "") or weechat.info_get(
         "weechat_dir", ""
     )
+
+
+def get_weemoji_path() -> str:
+    weechat_dir = get_weechat_data_dir()
     weechat_sharedir = weechat.info_get("weechat_sharedir", "")
     local_weemoji, global_weemoji = (
         f"{path}/weemoji.json" for path in (weechat_dir, weechat_sharedir)
     )
-    path = (
+    return (
         global_weemoji
         if os.path.exists(global_weemoji) and not os.path.exists(local_weemoji)
         else local_weemoji
     )
-    if not os.path.exists(path):
-        return {}
 
-    try:
-        with open(path) as f:
-            emojis: Dict[str, Emoji] = json.loads(f.read())
-
-            emojis_skin_tones: Dict[str, Emoji] = {
-                skin_tone["name"]: {
-                    "name": skin_tone["name"],
-                    "unicode": skin_tone["unicode"],
-                }
-                for emoji in emojis.values()
-                if "skinVariations" in emoji
-                for skin_tone in emoji["skinVariations"].values()
-            }
 
-            emojis.update(emojis_skin_tones)
-            return emojis
-    except Exception as e:
-        print_error(f"couldn't read weemoji.json: {store_and_format_exception(e)}")
-        return {}
+class EmojiStore:
+    """Standard emojis from weemoji.json, loaded on first use.
+
+    The emojis are kept as two parallel lists sorted by name, so lookups and
+    prefix completion can use bisect. The lists are read from an index file
+    in the WeeChat data dir, which is generated from weemoji.json whenever
+    weemoji.json changes, so the JSON only has to be parsed once.
+    """
+
+    # Increase when the format of the index file changes
+    index_version = 1
+
+    def __init__(self):
+        self._loaded = False
+        self._names: List[str] = []
+        self._unicodes: List[str] = []
+        self._alias_indexes: Set[int] = set()
+        self._inverse: Optional[Dict[str, str]] = None
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+
+        path = get_weemoji_path()
+        if not os.path.exists(path):
+            return
+
+        index_path = f"{get_weechat_data_dir()}/slack_emoji_index.tsv"
+        header = f"{self.index_version}\t{path}\t{os.stat(path).st_mtime_ns}"
+        try:
+            rows = self._read_index(index_path, header)
+            if rows is None:
+                rows = self._build_index(path)
+                self._write_index(index_path, header, rows)
+        except Exception as e:
+            print_error(f"couldn't read weemoji.json: {store_and_format_exception(e)}")
+            return
+
+        for index, (name, unicode, alias_of) in enumerate(rows):
+            self._names.append(name)
+            self._unicodes.append(unicode)
+            if alias_of:
+                self._alias_indexes.add(index)
+
+    def _read_index(
+        self, index_path: str, header: str
+    ) -> Optional[List[Tuple[str, str, str]]]:
+        try:
+            with open(index_path, encoding="utf-8") as f:
+                if f.readline().rstrip("\n") != header:
+                    return None
+                rows = [line.rstrip("\n").split("\t") for line in f]
+        except OSError:
+            return None
+        if any(len(row) != 3 for row in rows):
+            return None
+        return [(name, unicode, alias_of) for name, unicode, alias_of in rows]
+
+    def _build_index(self, path: str) -> List[Tuple[str, str, str]]:
+        with open(path, encoding="utf-8") as f:
+            emojis: Dict[str, Emoji] = json.load(f)
+
+        rows: List[Tuple[str, str, str]] = []
+        for name, emoji in emojis.items():
+            rows.append((name, emoji["unicode"], emoji.get("aliasOf", "")))
+            for skin_tone in emoji.get("skinVariations", {}).values():
+                rows.append((skin_tone["name"], skin_tone["unicode"], ""))
+        rows.sort()
+        return rows
+
+    def _write_index(
+        self, index_path: str, header: str, rows: List[Tuple[str, str, str]]
+    ):
+        tmp_path = f"{index_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(header + "\n")
+                f.writelines("\t".join(row) + "\n" for row in rows)
+            os.replace(tmp_path, index_path)
+        except OSError as e:
+            log(
+                LogLevel.WARN,
+                DebugMessageType.LOG,
+                f"couldn't write emoji index {index_path}: {e}",
+            )
+
+    def get(self, name: str) -> Optional[str]:
+        self._load()
+        index = bisect_left(self._names, name)
+        if index < len(self._names) and self._names[index] == name:
+            return self._unicodes[index]
+        return None
+
+    def names_with_prefix(self, prefix: str) -> Iterable[str]:
+        self._load()
+        start = bisect_left(self._names, prefix)
+        for index in range(start, len(self._names)):
+            name = self._names[index]
+            if not name.startswith(prefix):
+                break
+            yield name
+
+    def name_for_unicode(self, unicode: str) -> Optional[str]:
+        if self._inverse is None:
+            self._load()
+            self._inverse = {}
+            # Prefer the canonical names over their aliases
+            for index, name in enumerate(self._names):
+                if index not in self._alias_indexes:
+                    self._inverse.setdefault(self._unicodes[index], name)
+            for index in self._alias_indexes:
+                self._inverse.setdefault(self._unicodes[index], self._names[index])
+        return self._inverse.get(unicode)
 
 
 def get_emoji(emoji_name: str, skin_tone: Optional[int] = None) -> str:
@@ -5957,16 +7129,16 @@ def get_emoji(emoji_name: str, skin_tone: Optional[int] = None) -> str:
     if shared.config.look.render_emoji_as.value == "name":
         return emoji_name_with_colons
 
-    emoji_item = shared.standard_emojis.get(emoji_name)
-    if emoji_item is None:
+    emoji_unicode = shared.standard_emojis.get(emoji_name)
+    if emoji_unicode is None:
         return emoji_name_with_colons
 
-    skin_tone_item = (
-        emoji_item.get("skinVariations", {}).get(str(skin_tone)) if skin_tone else None
-    )
-    emoji_unicode = (
-        skin_tone_item["unicode"] if skin_tone_item else emoji_item["unicode"]
-    )
+    if skin_tone:
+        skin_tone_unicode = shared.standard_emojis.get(
+            f"{emoji_name}::skin-tone-{skin_tone}"
+        )
+        if skin_tone_unicode is not None:
+            emoji_unicode = skin_tone_unicode
 
     if shared.config.look.render_emoji_as.value == "emoji":
         return emoji_unicode
@@ -6254,6 +7426,7 @@ class SlackThread(SlackMessageBuffer):
 
     async def buffer_switched_to(self):
         await super().buffer_switched_to()
+        self.conversation.mark_thread_used(self.parent.ts)
         await self.fill_history()
 
     async def set_hotlist(self):
@@ -6360,11 +7533,23 @@ class Nick:
         return with_color(color, self.raw_nick) + self.suffix
 
 
+NICK_COLOR_CACHE_SIZE = 10000
+nick_color_cache: OrderedDict[str, str] = OrderedDict()
+
+
 def nick_color(nick: str, is_self: bool = False) -> str:
     if is_self:
         return weechat.config_string(weechat.config_get("weechat.color.chat_nick_self"))
 
-    return weechat.info_get("nick_color_name", nick)
+    color = nick_color_cache.get(nick)
+    if color is None:
+        color = weechat.info_get("nick_color_name", nick)
+        nick_color_cache[nick] = color
+        if len(nick_color_cache) > NICK_COLOR_CACHE_SIZE:
+            nick_color_cache.popitem(last=False)
+    else:
+        nick_color_cache.move_to_end(nick)
+    return color
 
 
 # TODO: Probably need to do some mapping here based on the existing users, in case some has been changed to avoid duplicate names
@@ -6415,6 +7600,9 @@ class SlackUser:
     def __init__(self, workspace: SlackWorkspace, info: SlackUserInfo):
         self.workspace = workspace
         self._info = info
+        self._nick: Optional[Nick] = None
+        self._nick_generation = shared.nick_generation
+        self.workspace.users.update_nick_index(self)
 
     @classmethod
     async def create(cls, workspace: SlackWorkspace, id: str):
@@ -6456,11 +7644,30 @@ class SlackUser:
 
     @property
     def nick(self) -> Nick:
-        nick = name_from_user_info(self.workspace, self._info)
-        return get_user_nick(nick, self.is_external, self.is_self)
+        if self._nick is None or self._nick_generation != shared.nick_generation:
+            nick = name_from_user_info(self.workspace, self._info)
+            self._nick = get_user_nick(nick, self.is_external, self.is_self)
+            self._nick_generation = shared.nick_generation
+        return self._nick
+
+    def _name_fields(self) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        # The fields the nick is made from. The nick itself isn't compared,
+        # since it depends on my_user, which isn't set while connecting.
+        profile = self._info["profile"]
+        return (
+            profile.get("display_name"),
+            profile.get("real_name") or self._info.get("real_name"),
+            self._info.get("name"),
+        )
 
     def update_info_json(self, info_json: SlackUserInfo):
+        previous_name_fields = self._name_fields()
         self._info.update(info_json)  # pyright: ignore [reportArgumentType, reportCallIssue]
+        self._nick = None
+        self.workspace.users.update_nick_index(self)
+        self.workspace.users.set_cached_info(self.id, self._info)
+        if self._name_fields() != previous_name_fields:
+            self.workspace.rerender_dependents("user", self.id)
 
         for conversation in self.workspace.open_conversations.values():
             if conversation.im_user_id == self.id:
@@ -6471,6 +7678,8 @@ class SlackBot:
     def __init__(self, workspace: SlackWorkspace, info: SlackBotInfo):
         self.workspace = workspace
         self._info = info
+        self._nick: Optional[Nick] = None
+        self._nick_generation = shared.nick_generation
 
     @classmethod
     async def create(cls, workspace: SlackWorkspace, id: str):
@@ -6479,7 +7688,14 @@ class SlackBot:
 
     @property
     def nick(self) -> Nick:
-        return get_bot_nick(self._info["name"])
+        if self._nick is None or self._nick_generation != shared.nick_generation:
+            self._nick = get_bot_nick(self._info["name"])
+            self._nick_generation = shared.nick_generation
+        return self._nick
+
+    def update_info_json(self, info_json: SlackBotInfo):
+        self._info.update(info_json)  # pyright: ignore [reportArgumentType, reportCallIssue]
+        self._nick = None
 
 
 class SlackUsergroup:
@@ -6500,7 +7716,11 @@ class SlackUsergroup:
         return self._info["handle"]
 
     def update_info_json(self, info_json: Union[SlackUsergroupInfo, SlackSubteam]):
+        previous_handle = self.handle()
         self._info.update(info_json)
+        self.workspace.usergroups.set_cached_info(self._info["id"], self._info)
+        if self.handle() != previous_handle:
+            self.workspace.rerender_dependents("usergroup", self._info["id"])
 
 
 if TYPE_CHECKING:
@@ -6538,6 +7758,109 @@ def workspace_get_buffer_to_merge_with() -> Optional[str]:
             return workspace_buffers_by_number[lowest_number]
 
 
+class SlackCache:
+    # Increase when the format of the cached info changes, to discard old caches
+    version = 2
+
+    def __init__(self, path: str):
+        self.path = path
+        self._db: Optional[sqlite3.Connection] = None
+        self._failed = False
+        self._pending_writes: Dict[Tuple[str, str, str], str] = {}
+        self._flush_scheduled = False
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        if self._db is None and not self._failed:
+            try:
+                db = sqlite3.connect(self.path)
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS meta "
+                    "(key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+                )
+                row = db.execute(
+                    "SELECT value FROM meta WHERE key = 'version'"
+                ).fetchone()
+                if row is None or row[0] != str(self.version):
+                    db.execute("DROP TABLE IF EXISTS items")
+                    db.execute(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)",
+                        (str(self.version),),
+                    )
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS items "
+                    "(workspace_id TEXT NOT NULL, kind TEXT NOT NULL, id TEXT NOT NULL, "
+                    "info TEXT NOT NULL, PRIMARY KEY (workspace_id, kind, id))"
+                )
+                db.commit()
+                self._db = db
+            except sqlite3.Error as e:
+                self._disable(e)
+        return self._db
+
+    def _disable(self, e: sqlite3.Error):
+        print_error(f"disabling cache {self.path}: {format_exception_only_str(e)}")
+        self._failed = True
+        self._pending_writes.clear()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def get(self, workspace_id: str, kind: str, item_id: str) -> Optional[Any]:
+        key = (workspace_id, kind, item_id)
+        if key in self._pending_writes:
+            return json.loads(self._pending_writes[key])
+        db = self._connection()
+        if db is None:
+            return None
+        try:
+            row = db.execute(
+                "SELECT info FROM items WHERE workspace_id = ? AND kind = ? AND id = ?",
+                key,
+            ).fetchone()
+        except sqlite3.Error as e:
+            self._disable(e)
+            return None
+        return json.loads(row[0]) if row else None
+
+    def set(self, workspace_id: str, kind: str, item_id: str, info: object):
+        if self._failed:
+            return
+        self._pending_writes[(workspace_id, kind, item_id)] = json.dumps(info)
+        if not self._flush_scheduled:
+            self._flush_scheduled = True
+            run_async(self._flush_later())
+
+    async def _flush_later(self):
+        # Writes are batched, since items are often created in bursts
+        await sleep(5000)
+        self.flush()
+
+    def flush(self):
+        self._flush_scheduled = False
+        if not self._pending_writes:
+            return
+        db = self._connection()
+        if db is None:
+            return
+        writes = [(*key, info) for key, info in self._pending_writes.items()]
+        self._pending_writes.clear()
+        try:
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO items (workspace_id, kind, id, info) "
+                    "VALUES (?, ?, ?, ?)",
+                    writes,
+                )
+        except sqlite3.Error as e:
+            self._disable(e)
+
+    def close(self):
+        self.flush()
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+
 SlackItemClass = TypeVar(
     "SlackItemClass", SlackConversation, SlackUser, SlackBot, SlackUsergroup
 )
@@ -6553,15 +7876,135 @@ SlackItemInfo = TypeVar(
 class SlackItem(
     ABC, Generic[SlackItemClass, SlackItemInfo], Dict[str, Future[SlackItemClass]]
 ):
-    def __init__(self, workspace: SlackWorkspace, item_class: Type[SlackItemClass]):
+    # Whether items which are missing should be fetched together in batches,
+    # which requires that _fetch_items_info fetches multiple items per request
+    _batch_missing_items = False
+    # Keys of the info which are outdated quickly, like the read state, so
+    # they are not cached, and items created from the cache don't use stale
+    # values for them before they are revalidated
+    _uncached_info_keys: Tuple[str, ...] = ()
+
+    def __init__(
+        self,
+        workspace: SlackWorkspace,
+        item_class: Type[SlackItemClass],
+        cache_kind: str,
+    ):
         super().__init__()
         self.workspace = workspace
         self._item_class = item_class
+        self._cache_kind = cache_kind
+        self._item_ids_to_revalidate: Set[str] = set()
+        self._revalidate_task: Optional[Task[None]] = None
+        # The tasks revalidating the items which were created from the cache
+        self._revalidate_tasks: Dict[str, Task[None]] = {}
+        self._missing_item_ids: Set[str] = set()
+        self._missing_items_info_task: Optional[Task[Dict[str, SlackItemInfo]]] = None
 
     def __missing__(self, key: str):
-        self[key] = create_task(self._create_item(key))
+        cached_info = self._get_cached_info(key)
+        if cached_info is not None:
+            self[key] = create_task(self._create_item_from_info(cached_info))
+            self._revalidate_later(key)
+        elif self._batch_missing_items:
+            if self._missing_items_info_task is None:
+                self._missing_items_info_task = create_task(
+                    self._fetch_missing_items_info()
+                )
+            self._missing_item_ids.add(key)
+            self[key] = create_task(
+                self._create_item(key, self._missing_items_info_task)
+            )
+        else:
+            self[key] = create_task(self._create_item(key))
         return self[key]
 
+    async def _fetch_missing_items_info(self) -> Dict[str, SlackItemInfo]:
+        # Wait a bit, so the items which are looked up while rendering are
+        # fetched together
+        await sleep(10)
+        item_ids = self._missing_item_ids
+        self._missing_item_ids = set()
+        self._missing_items_info_task = None
+        try:
+            items_info = await self._fetch_items_info(item_ids)
+        except Exception:
+            if len(item_ids) == 1:
+                raise
+            items_info = {}
+
+        # Don't let one item which fails make all the other items fail, and
+        # retry the items which were missing in the response on their own
+        missing_item_ids = (
+            item_ids.difference(items_info) if len(item_ids) > 1 else set()
+        )
+        responses = await gather(
+            *(self._fetch_items_info([item_id]) for item_id in missing_item_ids),
+            return_exceptions=True,
+        )
+        for response in responses:
+            if not isinstance(response, BaseException):
+                items_info.update(response)
+        return items_info
+
+    @property
+    def _use_cache(self) -> bool:
+        # The workspace id is only known after connecting
+        return self.workspace.config.cache_items.value and hasattr(self.workspace, "id")
+
+    def _get_cached_info(self, item_id: str) -> Optional[SlackItemInfo]:
+        if not self._use_cache:
+            return None
+        return shared.cache.get(self.workspace.id, self._cache_kind, item_id)
+
+    def set_cached_info(self, item_id: str, item_info: SlackItemInfo):
+        if self._use_cache:
+            cached_info = {
+                key: value
+                for key, value in item_info.items()
+                if key not in self._uncached_info_keys
+            }
+            shared.cache.set(self.workspace.id, self._cache_kind, item_id, cached_info)
+
+    def _revalidate_later(self, item_id: str):
+        if self._revalidate_task is None or not self._item_ids_to_revalidate:
+            self._revalidate_task = create_task(self._revalidate_cached_items())
+            self._revalidate_task.add_done_callback(_async_task_done)
+        self._item_ids_to_revalidate.add(item_id)
+        self._revalidate_tasks[item_id] = self._revalidate_task
+
+    async def wait_until_revalidated(self, item_id: str):
+        task = self._revalidate_tasks.get(item_id)
+        if task is not None:
+            await task
+
+    async def _revalidate_cached_items(self):
+        # Wait a bit, so the items created from the cache while connecting
+        # are fetched together
+        await sleep(1000)
+        item_ids = self._item_ids_to_revalidate
+        self._item_ids_to_revalidate = set()
+        try:
+            items_info = await self._fetch_items_info(item_ids)
+        except Exception as e:
+            log(
+                LogLevel.WARN,
+                DebugMessageType.LOG,
+                f"failed to revalidate cached {self._cache_kind} info for "
+                f"workspace {self.workspace.name}: {format_exception_only_str(e)}",
+            )
+            items_info = {}
+
+        try:
+            for item_id, item_info in items_info.items():
+                self.set_cached_info(item_id, item_info)
+                future = self.get(item_id)
+                if future is not None and future.done_with_result():
+                    future.result().update_info_json(item_info)
+        finally:
+            for item_id in item_ids:
+                self._revalidate_tasks.pop(item_id, None)
+
     def initialize_items(
         self,
         item_ids: Iterable[str],
@@ -6591,15 +8034,19 @@ class SlackItem(
         items_info_prefetched: Optional[Mapping[str, SlackItemInfo]] = None,
     ) -> SlackItemClass:
         if items_info_prefetched and item_id in items_info_prefetched:
-            return await self._create_item_from_info(items_info_prefetched[item_id])
+            item_info = items_info_prefetched[item_id]
         elif items_info_task:
             items_info = await items_info_task
             item = items_info.get(item_id)
             if item is None:
                 raise SlackError(self.workspace, "item_not_found")
-            return await self._create_item_from_info(item)
+            item_info = item
         else:
-            return await self._item_class.create(self.workspace, item_id)
+            item = await self._item_class.create(self.workspace, item_id)
+            self.set_cached_info(item_id, item._info)  # pyright: ignore [reportPrivateUsage]
+            return item
+        self.set_cached_info(item_id, item_info)
+        return await self._create_item_from_info(item_info)
 
     @abstractmethod
     async def _fetch_items_info(
@@ -6613,8 +8060,15 @@ class SlackItem(
 
 
 class SlackConversations(SlackItem[SlackConversation, SlackConversationsInfoInternal]):
+    _uncached_info_keys = (
+        "last_read",
+        "unread_count",
+        "unread_count_display",
+        "latest",
+    )
+
     def __init__(self, workspace: SlackWorkspace):
-        super().__init__(workspace, SlackConversation)
+        super().__init__(workspace, SlackConversation, "conversation")
 
     async def _fetch_items_info(
         self, item_ids: Iterable[str]
@@ -6636,8 +8090,81 @@ class SlackConversations(SlackItem[SlackConversation, SlackConversationsInfoInte
 
 
 class SlackUsers(SlackItem[SlackUser, SlackUserInfo]):
+    _batch_missing_items = True
+
     def __init__(self, workspace: SlackWorkspace):
-        super().__init__(workspace, SlackUser)
+        super().__init__(workspace, SlackUser, "user")
+        self._nick_to_user_id: Dict[str, str] = {}
+        self._user_id_to_nick: Dict[str, str] = {}
+        # Users which have been created or changed since the index was updated.
+        # They are added lazily, since the nick can't be computed before
+        # my_user is set.
+        self._nick_index_pending: Dict[str, SlackUser] = {}
+        self._nick_index_needs_rebuild = False
+        # (casefolded nick, nick, user id) for all users, sorted
+        self._sorted_nicks: List[Tuple[str, str, str]] = []
+
+    def update_nick_index(self, user: SlackUser):
+        self._nick_index_pending[user.id] = user
+
+    def invalidate_nick_index(self):
+        self._nick_index_needs_rebuild = True
+
+    def _refresh_nick_index(self):
+        rebuild = self._nick_index_needs_rebuild
+        if rebuild:
+            self._nick_index_needs_rebuild = False
+            self._nick_index_pending.clear()
+            self._nick_to_user_id.clear()
+            self._user_id_to_nick.clear()
+            self._sorted_nicks.clear()
+            users = get_resolved_futures(self.values())
+        else:
+            users = list(self._nick_index_pending.values())
+            self._nick_index_pending.clear()
+
+        for user in users:
+            nick = user.nick.raw_nick
+            old_nick = self._user_id_to_nick.get(user.id)
+            if old_nick == nick:
+                continue
+            if old_nick is not None:
+                if self._nick_to_user_id.get(old_nick) == user.id:
+                    del self._nick_to_user_id[old_nick]
+                old_entry = (old_nick.casefold(), old_nick, user.id)
+                index = bisect_left(self._sorted_nicks, old_entry)
+                if (
+                    index < len(self._sorted_nicks)
+                    and self._sorted_nicks[index] == old_entry
+                ):
+                    del self._sorted_nicks[index]
+            self._user_id_to_nick[user.id] = nick
+            self._nick_to_user_id[nick] = user.id
+            if rebuild:
+                self._sorted_nicks.append((nick.casefold(), nick, user.id))
+            else:
+                insort(self._sorted_nicks, (nick.casefold(), nick, user.id))
+
+        if rebuild:
+            self._sorted_nicks.sort()
+
+    def user_id_from_nick(self, nick: str) -> Optional[str]:
+        self._refresh_nick_index()
+        return self._nick_to_user_id.get(nick)
+
+    def nicks_with_prefix(self, prefix: str) -> List[str]:
+        # The nicks are sorted case insensitively, so all nicks starting with
+        # the prefix are in one range
+        self._refresh_nick_index()
+        prefix_casefolded = prefix.casefold()
+        start = bisect_left(self._sorted_nicks, (prefix_casefolded,))
+        nicks: List[str] = []
+        for index in range(start, len(self._sorted_nicks)):
+            nick_casefolded, nick, _ = self._sorted_nicks[index]
+            if not nick_casefolded.startswith(prefix_casefolded):
+                break
+            nicks.append(nick)
+        return nicks
 
     async def _fetch_items_info(
         self, item_ids: Iterable[str]
@@ -6650,8 +8177,10 @@ class SlackUsers(SlackItem[SlackUser, SlackUserInfo]):
 
 
 class SlackBots(SlackItem[SlackBot, SlackBotInfo]):
+    _batch_missing_items = True
+
     def __init__(self, workspace: SlackWorkspace):
-        super().__init__(workspace, SlackBot)
+        super().__init__(workspace, SlackBot, "bot")
 
     async def _fetch_items_info(
         self, item_ids: Iterable[str]
@@ -6667,7 +8196,7 @@ class SlackUsergroups(
     SlackItem[SlackUsergroup, Union[SlackUsergroupInfo, SlackSubteam]]
 ):
     def __init__(self, workspace: SlackWorkspace):
-        super().__init__(workspace, SlackUsergroup)
+        super().__init__(workspace, SlackUsergroup, "usergroup")
 
     async def _fetch_items_info(
         self, item_ids: Iterable[str]
@@ -6683,6 +8212,56 @@ class SlackUsergroups(
         return self._item_class(self.workspace, item_info)
 
 
+# Number of seconds file info from files.info is reused when rendering messages
+FILES_INFO_CACHE_TTL = 300
+
+
+def rtm_event_conversation_id(data: SlackRtmMessage) -> Optional[str]:
+    if data["type"] == "channel_joined" or data["type"] == "group_joined":
+        return data["channel"]["id"]
+    elif data["type"] == "reaction_added" or data["type"] == "reaction_removed":
+        return data["item"]["channel"]
+    elif (
+        data["type"] == "thread_marked"
+        or data["type"] == "thread_subscribed"
+        or data["type"] == "thread_unsubscribed"
+    ) and data["subscription"]["type"] == "thread":
+        return data["subscription"]["channel"]
+    elif data["type"] == "sh_room_join" or data["type"] == "sh_room_update":
+        return data["huddle"]["channel_id"]
+    elif "channel" in data and isinstance(data["channel"], str):
+        return data["channel"]
+    else:
+        return None
+
+
+def remove_superseded_rtm_events(
+    events: List[SlackRtmMessage],
+) -> List[SlackRtmMessage]:
+    # A message_changed event contains the whole changed message, so only the
+    # last change of each message has to be handled
+    def changed_message_key(event: SlackRtmMessage) -> Optional[Tuple[str, str]]:
+        if (
+            event["type"] == "message"
+            and event.get("subtype") == "message_changed"
+            and "message" in event
+        ):
+            return (event["channel"], event["message"]["ts"])
+        return None
+
+    last_change_index: Dict[Tuple[str, str], int] = {}
+    for index, event in enumerate(events):
+        key = changed_message_key(event)
+        if key is not None:
+            last_change_index[key] = index
+
+    return [
+        event
+        for index, event in enumerate(events)
+        if last_change_index.get(changed_message_key(event), index) == index
+    ]
+
+
 class SlackWorkspace:
     def __init__(self, name: str):
         self.name = name
@@ -6693,6 +8272,9 @@ class SlackWorkspace:
         self._is_connected = False
         self._connect_task: Optional[Task[bool]] = None
         self._ws: Optional[WebSocket] = None
+        self.ws_frames_received = 0
+        self.ws_bytes_received = 0
+        self.ws_decode_time = 0.0
         self._hook_ws_fd: Optional[str] = None
         self._last_ws_received_time = time.time()
         self._debug_ws_buffer_pointer: Optional[str] = None
@@ -6709,6 +8291,22 @@ class SlackWorkspace:
         self.global_keywords_regex: Optional[re.Pattern[str]] = None
         self.custom_emojis: Dict[str, str] = {}
         self.max_users_per_fetch_request = 512
+        self.max_bots_per_fetch_request = 512
+        self.history_rate_limiter = RateLimiter(
+            self.config.history_load_rate_limit.value, 10
+        )
+        self.thread_replies_semaphore = Semaphore(
+            self.config.thread_replies_concurrency.value
+        )
+        # Ordered by fetch time, so expired entries are at the start
+        self._files_info: OrderedDict[str, Tuple[float, Task[SlackFile]]] = (
+            OrderedDict()
+        )
+        # The messages which have to be rerendered when an item changes
+        self._render_dependents: Dict[Tuple[str, str], WeakSet[SlackMessage]] = {}
+        # Remove the items no messages depend on anymore when there are this
+        # many items
+        self._render_dependents_prune_size = 1000
 
     def __repr__(self):
         return f"{self.__class__.__name__}({self.name})"
@@ -6877,6 +8475,7 @@ class SlackWorkspace:
             future = Future[SlackUsergroup]()
             future.set_result(SlackUsergroup(self, usergroup))
             self.usergroups[usergroup["id"]] = future
+            self.usergroups.set_cached_info(usergroup["id"], usergroup)
         self.usergroups_member = set(
             u["id"]
             for u in usergroups["usergroups"]
@@ -6896,7 +8495,7 @@ class SlackWorkspace:
             c for c in conversations_if_should_open if c is not None
         ]
 
-        # Load the first 1000 chanels to be able to look them up by name, since
+        # Load the first 1000 channels to be able to look them up by name, since
         # we can't look up a channel id from channel name with OAuth tokens
         first_channels = await self.api.fetch_conversations_list_public(limit=1000)
         self.conversations.initialize_items(
@@ -6987,8 +8586,16 @@ class SlackWorkspace:
 
         self.update_buffer_props()
 
-        custom_emojis_response = await self.api.fetch_emoji_list()
-        self.custom_emojis = custom_emojis_response["emoji"]
+        cached_custom_emojis: Optional[Dict[str, str]] = (
+            shared.cache.get(self.id, "custom_emojis", "")
+            if self.config.cache_items.value
+            else None
+        )
+        if cached_custom_emojis is not None:
+            self.custom_emojis = cached_custom_emojis
+            run_async(self._fetch_custom_emojis())
+        else:
+            await self._fetch_custom_emojis()
 
         for conversation in sorted(
             conversations_to_open, key=lambda conversation: conversation.sort_key()
@@ -7003,6 +8610,82 @@ class SlackWorkspace:
             )
         )
 
+    async def fetch_file_info(self, file_id: str) -> SlackFile:
+        # Messages are rerendered often (e.g. on reactions and edits), so share
+        # the file info between renders and between concurrent resolves
+        cached = self._files_info.get(file_id)
+        if cached is not None:
+            fetched_time, task = cached
+            if (
+                not task.done()
+                or time.time() - fetched_time < FILES_INFO_CACHE_TTL
+                and task.done_with_result()
+            ):
+                return await task
+            del self._files_info[file_id]
+
+        self._remove_expired_files_info()
+        task = create_task(self._fetch_file_info(file_id))
+        self._files_info[file_id] = (time.time(), task)
+        return await task
+
+    def _remove_expired_files_info(self):
+        now = time.time()
+        while self._files_info:
+            fetched_time, task = next(iter(self._files_info.values()))
+            if not task.done() or now - fetched_time < FILES_INFO_CACHE_TTL:
+                break
+            self._files_info.popitem(last=False)
+
+    async def _fetch_file_info(self, file_id: str) -> SlackFile:
+        file_response = await self.api.fetch_files_info(file_id)
+        return file_response["file"]
+
+    def invalidate_file_info(self, file_id: str):
+        self._files_info.pop(file_id, None)
+
+    def add_render_dependency(
+        self,
+        item_type: Literal["conversation", "user", "usergroup"],
+        item_id: str,
+        message: SlackMessage,
+    ):
+        key = (item_type, item_id)
+        messages = self._render_dependents.get(key)
+        if messages is None:
+            if len(self._render_dependents) >= self._render_dependents_prune_size:
+                self._prune_render_dependents()
+            messages = self._render_dependents[key] = WeakSet()
+        messages.add(message)
+
+    def _prune_render_dependents(self):
+        # The messages are removed from the sets when they are garbage
+        # collected, so remove the sets which are empty
+        for key, messages in list(self._render_dependents.items()):
+            if not messages:
+                del self._render_dependents[key]
+        self._render_dependents_prune_size = max(2 * len(self._render_dependents), 1000)
+
+    def rerender_dependents(
+        self, item_type: Literal["conversation", "user", "usergroup"], item_id: str
+    ):
+        key = (item_type, item_id)
+        messages = self._render_dependents.get(key)
+        if messages is None:
+            return
+        if not messages:
+            del self._render_dependents[key]
+            return
+        for message in list(messages):
+            message.invalidate_rendered_message(reparse=False, prefix=True)
+            message.conversation.schedule_rerender(message)
+
+    async def _fetch_custom_emojis(self):
+        custom_emojis_response = await self.api.fetch_emoji_list()
+        self.custom_emojis = custom_emojis_response["emoji"]
+        if self.config.cache_items.value:
+            shared.cache.set(self.id, "custom_emojis", "", self.custom_emojis)
+
     async def _conversation_if_should_open(self, info: SlackUsersConversations):
         conversation = await self.conversations[info["id"]]
         if not conversation.should_open():
@@ -7013,34 +8696,79 @@ class SlackWorkspace:
                 history = await self.api.fetch_conversations_history(conversation)
             else:
                 history = await self.api.fetch_conversations_history_after(
-                    conversation, conversation.last_read
+                    conversation, conversation.last_read, limit=1
                 )
             if not history["messages"]:
                 return
 
         return conversation
 
+    def _history_load_priority(self, conversation: SlackConversation) -> int:
+        if (
+            conversation.buffer_pointer
+            and conversation.buffer_pointer == shared.current_buffer_pointer
+        ):
+            return 0
+        hotlist_priority = (
+            buffer_hotlist_priority(conversation.buffer_pointer)
+            if conversation.buffer_pointer
+            else None
+        )
+        if hotlist_priority == int(weechat.WEECHAT_HOTLIST_HIGHLIGHT):
+            return 1
+        if conversation.buffer_type == "private":
+            return 2
+        return 3
+
     async def _load_unread_conversations(self):
-        open_conversations = list(self.open_conversations.values())
-        for conversation in open_conversations:
-            if (
-                conversation.hotlist_tss
-                and not conversation.muted
-                and self.is_connected
-            ):
-                await conversation.fill_history()
-                # TODO: Better sleep heuristic
-                sleep_duration = (
-                    20000 if conversation.display_thread_replies() else 1000
-                )
-                await sleep(sleep_duration)
+        # The conversations are loaded concurrently, but history requests are
+        # limited by history_rate_limiter, which also backs off when Slack
+        # responds with a ratelimit. The next conversation is picked when a
+        # slot is free, so the priority can change while loading.
+        self.history_rate_limiter.requests_per_minute = (
+            self.config.history_load_rate_limit.value
+        )
+        pending = list(self.open_conversations.values())
+
+        async def load_conversations():
+            while pending and self.is_connected:
+                conversation = min(pending, key=self._history_load_priority)
+                pending.remove(conversation)
+                if not conversation.hotlist_tss or conversation.muted:
+                    continue
+                await self.history_rate_limiter.wait()
+                if not self.is_connected:
+                    return
+                try:
+                    await conversation.fill_history()
+                except Exception as e:
+                    print_exception_once(e)
+
+        await gather(
+            *(
+                load_conversations()
+                for _ in range(self.config.history_load_concurrency.value)
+            )
+        )
 
     async def _connect_ws(self, url: str):
         proxy = Proxy()
+        receive_buffer_size = (
+            shared.config.network.websocket_receive_buffer_size.value * 1024
+        )
+        sockopt = (
+            [(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_size)]
+            if receive_buffer_size
+            else []
+        )
         # TODO: Handle errors
         self._ws = create_connection(
             url,
             self.config.network_timeout.value,
+            sockopt=sockopt,
+            # The frames are decoded with json.loads, which validates the
+            # UTF-8, so don't spend time validating it twice
+            skip_utf8_validation=True,
             cookie=get_cookies(self.config.api_cookies.value),
             proxy_type=proxy.type,
             http_proxy_host=proxy.address,
@@ -7063,29 +8791,66 @@ class SlackWorkspace:
     def _ws_read_cb(self, data: str, fd: int) -> int:
         if self._ws is None:
             raise SlackError(self, "ws_read_cb called while _ws is None")
+        batch_events = shared.config.network.batch_websocket_events.value
+        events: List[SlackRtmMessage] = []
         while True:
             try:
                 opcode, recv_data = self._ws.recv_data(control_frame=True)
             except ssl.SSLWantReadError:
                 # No more data to read at this time.
-                return weechat.WEECHAT_RC_OK
+                break
             except (WebSocketConnectionClosedException, socket.error) as e:
                 print("lost connection on receive, reconnecting", e)
+                self._ws_recv_batch(events)
                 run_async(self.reconnect())
                 return weechat.WEECHAT_RC_OK
 
             self._last_ws_received_time = time.time()
 
             if opcode == ABNF.OPCODE_PONG:
-                return weechat.WEECHAT_RC_OK
+                break
             elif opcode != ABNF.OPCODE_TEXT:
-                return weechat.WEECHAT_RC_OK
+                break
+
+            decode_start_time = time.perf_counter()
+            event = json.loads(recv_data.decode())
+            self.ws_decode_time += time.perf_counter() - decode_start_time
+            self.ws_frames_received += 1
+            self.ws_bytes_received += len(recv_data)
+            if batch_events:
+                events.append(event)
+            else:
+                run_async(self.ws_recv(event))
+
+        self._ws_recv_batch(events)
+        return weechat.WEECHAT_RC_OK
 
-            run_async(self.ws_recv(json.loads(recv_data.decode())))
+    def _ws_recv_batch(self, events: List[SlackRtmMessage]):
+        if not events:
+            return
+
+        # Events for the same conversation are handled in order by one task,
+        # while different conversations are handled by separate tasks
+        events_by_conversation: Dict[Optional[str], List[SlackRtmMessage]] = (
+            defaultdict(list)
+        )
+        if any(event["type"] == "hello" for event in events):
+            # Everything depends on the initialization done on hello
+            events_by_conversation[None] = events
+        else:
+            for event in remove_superseded_rtm_events(events):
+                conversation_id = rtm_event_conversation_id(event)
+                events_by_conversation[conversation_id].append(event)
+
+        for conversation_events in events_by_conversation.values():
+            run_async(self._ws_recv_in_order(conversation_events))
+
+    async def _ws_recv_in_order(self, events: List[SlackRtmMessage]):
+        for event in events:
+            await self.ws_recv(event)
 
     async def ws_recv(self, data: SlackRtmMessage):
-        # TODO: Remove old messages
-        log(LogLevel.DEBUG, DebugMessageType.WEBSOCKET_RECV, json.dumps(data))
+        log(LogLevel.DEBUG, DebugMessageType.WEBSOCKET_RECV, lambda: json.dumps(data))
 
         try:
             if data["type"] == "hello":
@@ -7118,7 +8883,7 @@ class SlackWorkspace:
                     self._set_muted_channels(new_muted_channels)
                     self._set_global_keywords(new_prefs)
                 return
-            elif data["type"] == "user_status_changed":
+            elif data["type"] == "user_status_changed" or data["type"] == "user_change":
                 user_id = data["user"]["id"]
                 if user_id in self.users:
                     user = await self.users[user_id]
@@ -7148,6 +8913,33 @@ class SlackWorkspace:
                     usergroup = await self.usergroups[subteam_id]
                     usergroup.update_info_json(data["subteam"])
                 return
+            elif (
+                data["type"] == "file_change"
+                or data["type"] == "file_deleted"
+                or data["type"] == "file_public"
+                or data["type"] == "file_shared"
+                or data["type"] == "file_unshared"
+            ):
+                self.invalidate_file_info(data["file_id"])
+                return
+            elif data["type"] == "channel_rename" or data["type"] == "group_rename":
+                channel_id = data["channel"]["id"]
+                if channel_id in self.conversations:
+                    conversation = await self.conversations[channel_id]
+                    conversation.update_info_json(data["channel"])
+                return
+            elif data["type"] == "emoji_changed":
+                if data["subtype"] == "add":
+                    self.custom_emojis[data["name"]] = data["value"]
+                elif data["subtype"] == "remove":
+                    for name in data["names"]:
+                        self.custom_emojis.pop(name, None)
+                elif data["subtype"] == "rename":
+                    self.custom_emojis.pop(data["old_name"], None)
+                    self.custom_emojis[data["new_name"]] = data["value"]
+                if self.config.cache_items.value:
+                    shared.cache.set(self.id, "custom_emojis", "", self.custom_emojis)
+                return
             elif data["type"] == "subteam_members_changed":
                 # Handling subteam_updated should be enough
                 return
@@ -7157,25 +8949,10 @@ class SlackWorkspace:
             elif data["type"] == "subteam_self_removed":
                 self.usergroups_member.remove(data["subteam_id"])
                 return
-            elif data["type"] == "channel_joined" or data["type"] == "group_joined":
-                channel_id = data["channel"]["id"]
-            elif data["type"] == "reaction_added" or data["type"] == "reaction_removed":
-                channel_id = data["item"]["channel"]
-            elif (
-                data["type"] == "thread_marked"
-                or data["type"] == "thread_subscribed"
-                or data["type"] == "thread_unsubscribed"
-            ) and data["subscription"]["type"] == "thread":
-                channel_id = data["subscription"]["channel"]
-            elif data["type"] == "sh_room_join" or data["type"] == "sh_room_update":
-                channel_id = data["huddle"]["channel_id"]
-            elif "channel" in data and isinstance(data["channel"], str):
-                channel_id = data["channel"]
-            else:
+
+            channel_id = rtm_event_conversation_id(data)
+            if channel_id is None:
                 if data["type"] not in [
-                    "file_public",
-                    "file_shared",
-                    "file_deleted",
                     "dnd_updated_user",
                 ]:
                     log(
@@ -7418,6 +9195,7 @@ class WeeChatConfig:
 
     def __post_init__(self):
         self.pointer = weechat.config_new(self.name, "", "")
+        self.options: List[WeeChatOption[Any]] = []
 
 
 @dataclass
@@ -7481,11 +9259,23 @@ class WeeChatOption(Generic[WeeChatOptionType]):
     evaluate_func: Optional[Callable[[WeeChatOptionType], WeeChatOptionType]] = None
 
     def __post_init__(self):
+        self._has_cached_value = False
+        self._cached_value: WeeChatOptionType
+        # Options which have this option as parent_option
+        self._dependent_options: List[WeeChatOption[WeeChatOptionType]] = []
         self._pointer = self._create_weechat_option()
+        if isinstance(self.parent_option, WeeChatOption):
+            self.parent_option._dependent_options.append(self)
+        self.section.weechat_config.options.append(self)
 
     def __bool__(self) -> bool:
         return bool(self.value)
 
+    def clear_cached_value(self):
+        self._has_cached_value = False
+        for option in self._dependent_options:
+            option.clear_cached_value()
+
     def _raw_value(self) -> WeeChatOptionType:
         if weechat.config_option_is_null(self._pointer):
             if isinstance(self.parent_option, str):
@@ -7498,9 +9288,19 @@ class WeeChatOption(Generic[WeeChatOptionType]):
 
     @property
     def value(self) -> WeeChatOptionType:
+        if self._has_cached_value:
+            return self._cached_value
         value = self._raw_value()
         if self.evaluate_func is not None:
-            return self.evaluate_func(value)
+            value = self.evaluate_func(value)
+        # Don't cache the default value of a parent option which doesn't exist
+        # yet (e.g. if the irc plugin isn't loaded), since creating it won't
+        # call _changed_cb
+        if not isinstance(self.parent_option, str) or weechat.config_get(
+            self.parent_option
+        ):
+            self._cached_value = value
+            self._has_cached_value = True
         return value
 
     @value.setter
@@ -7513,6 +9313,7 @@ class WeeChatOption(Generic[WeeChatOptionType]):
             raise Exception(f"Failed to set value for option: {self.name}")
 
     def value_set_as_str(self, value: str) -> int:
+        self.clear_cached_value()
         return weechat.config_option_set(self._pointer, value, 1)
 
     def value_set_null(self) -> int:
@@ -7520,6 +9321,7 @@ class WeeChatOption(Generic[WeeChatOptionType]):
             raise Exception(
                 f"Can't set null value for option without parent: {self.name}"
             )
+        self.clear_cached_value()
         return weechat.config_option_set_null(self._pointer, 1)
 
     @property
@@ -7537,6 +9339,7 @@ class WeeChatOption(Generic[WeeChatOptionType]):
         return "string"
 
     def _changed_cb(self, data: str, option: str, value: Optional[str] = None):
+        self.clear_cached_value()
         if self.callback_change:
             parent_changed = data == "parent_changed"
             if not parent_changed or weechat.config_option_is_null(self._pointer):